@@ -3,9 +3,29 @@ import pandas as pd
 from datetime import datetime
 import time
 import gspread
+import requests
 from oauth2client.service_account import ServiceAccountCredentials
 import streamlit.components.v1 as components
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import importlib.util
+import tempfile
+import zipfile
+import io
+import openpyxl
+import re
 import math
+import bisect
+from collections import defaultdict, deque
+import threading
+import sqlite3
+import json
+import os
+import random
+import uuid
+import weakref
+import invoice_export
 
 # --- CONFIGURATION ---
 st.set_page_config(page_title="NEW SUMEET ENTERPRISES", layout="wide", page_icon="☁️")
@@ -46,6 +66,8 @@ BANK_DETAILS = {
     "Branch": "Garkheda Aurangabad"
 }
 
+GST_RATE = 0.18  # CGST + SGST, split equally on invoices and exports
+
 # OPENING BALANCE MAPPING
 OPENING_BAL_COLS = {
     "Shop": "Op_Shop",
@@ -53,6 +75,22 @@ OPENING_BAL_COLS = {
     "Big Godown": "Op_Godown"
 }
 
+# CACHE STALENESS (seconds a loaded sheet is reused before refetching; writes refresh a sheet immediately)
+# Override per sheet with a [cache_ttl] section in secrets, e.g. Products = 600
+SHEET_TTL = {
+    "Products": 300, "Manufacturing": 120, "Quotations": 60, "Vendor_Payments": 60,
+    "Purchase": 60, "Transfers": 30, "Sales": 10, "Logs": 10,
+    "Purchase_Archive": 3600, "Sales_Archive": 3600, "Transfers_Archive": 3600
+}
+DEFAULT_TTL = 10
+
+# SHEETS API QUOTA (requests per minute for the service account; Google's per-user default is 60 each)
+# Override with a [sheets_quota] section in secrets, e.g. reads_per_minute = 300 after a quota increase
+SHEETS_QUOTA = {"reads_per_minute": 60, "writes_per_minute": 60, "burst": 10, "retries": 4, "max_backoff": 32, "timeout": 60}
+
+# PERIOD CLOSE: movements of closed periods move to "<sheet>_Archive" sheets (same columns)
+ARCHIVE_SUFFIX = "_Archive"
+
 # --- HELPER: SAFE FLOAT & NUMBER TO WORDS ---
 def safe_float(val):
     try:
@@ -62,6 +100,11 @@ def safe_float(val):
     except:
         return 0.0
 
+def to_num(series):
+    """Vectorized safe_float for a whole column: always float64, like safe_float (cheap for columns that already are)."""
+    if pd.api.types.is_numeric_dtype(series.dtype): return series.astype("float64").fillna(0.0)
+    return pd.to_numeric(series.astype(str).str.replace(",", "").str.replace("₹", "").str.strip(), errors="coerce").astype("float64").fillna(0.0)
+
 def num_to_words(num):
     try:
         d = { 0 : 'Zero', 1 : 'One', 2 : 'Two', 3 : 'Three', 4 : 'Four', 5 : 'Five',
@@ -89,33 +132,299 @@ def num_to_words(num):
     except:
         return "Amount in Words"
 
+# --- INSTRUMENTATION ---
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)  # histogram upper bounds; one more bucket above
+RUN_HISTORY = 500  # finished reruns kept for the Diagnostics page and its JSONL export
+RUN_EXPIRY_SECS = 3600  # an unfinished rerun (stopped by st.rerun/st.stop) idle this long is closed, its session likely gone
+
+def op_stats(): return {"calls": 0, "errors": 0, "ms": 0.0, "rows": 0, "hist": [0] * (len(LATENCY_BUCKETS_MS) + 1)}
+
+def merge_ops(into, ops):
+    for op, o in ops.items():
+        t = into.setdefault(op, op_stats())
+        for k in ("calls", "errors", "ms", "rows"): t[k] += o[k]
+        t["hist"] = [a + b for a, b in zip(t["hist"], o["hist"])]
+
+class Metrics:
+    """
+    Process-wide record of the instrumented hot paths. Every rerun of a session collects its own op
+    timings, rows moved and sheet cache hits/misses; when the session's next rerun starts, the record
+    moves to a bounded history and is added to the totals of the page it ran. Only unfinished reruns stay
+    in self.runs, and those idle past RUN_EXPIRY_SECS are closed. Work done outside any session (the outbox
+    thread) goes straight to the "(background)" totals.
+    """
+    def __init__(self):
+        self.lock = threading.Lock(); self.runs = {}; self.history = deque(maxlen=RUN_HISTORY); self.pages = {}
+
+    @staticmethod
+    def session():
+        ctx = get_script_run_ctx(suppress_warning=True)
+        return ctx.session_id if ctx else None
+
+    def new_run(self, sid):
+        now = time.time()
+        return {"session": sid[:8], "page": None, "start": now, "last": now, "ops": {}, "cache": {}}
+
+    def finish(self, run, end=None):
+        run["wall_ms"] = round(((end or run["last"]) - run["start"]) * 1000, 1)
+        self.history.append(run)
+        page = self.pages.setdefault(run["page"] or "(login)", {"reruns": 0, "ops": {}, "cache": {}})
+        page["reruns"] += 1; merge_ops(page["ops"], run["ops"])
+        for sheet, (hit, miss) in run["cache"].items():
+            c = page["cache"].setdefault(sheet, [0, 0]); c[0] += hit; c[1] += miss
+
+    def begin_run(self):
+        sid = self.session()
+        if sid is None: return
+        with self.lock:
+            prev = self.runs.pop(sid, None)
+            if prev is not None: self.finish(prev)
+            cutoff = time.time() - RUN_EXPIRY_SECS
+            for old in [k for k, r in self.runs.items() if r["last"] < cutoff]: self.finish(self.runs.pop(old))
+            self.runs[sid] = self.new_run(sid)
+
+    def end_run(self):
+        with self.lock:
+            run = self.runs.pop(self.session(), None)
+            if run is not None: self.finish(run, time.time())
+
+    def set_page(self, page):
+        with self.lock:
+            run = self.runs.get(self.session())
+            if run is not None: run["page"] = page
+
+    def target(self):
+        """The current rerun's record, or the background totals outside a session. Call with the lock held."""
+        sid = self.session()
+        run = self.runs.get(sid) if sid else None
+        if run is None:
+            bg = self.pages.setdefault("(background)", {"reruns": 0, "ops": {}, "cache": {}})
+            return bg, None
+        return run, run
+
+    def record(self, op, ms, rows=0, error=False):
+        with self.lock:
+            rec, run = self.target()
+            o = rec["ops"].setdefault(op, op_stats())
+            o["calls"] += 1; o["errors"] += int(error); o["ms"] += ms; o["rows"] += rows
+            o["hist"][bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+            if run is not None: run["last"] = time.time()
+
+    def cache(self, sheet_name, hit):
+        with self.lock:
+            rec, _ = self.target()
+            c = rec["cache"].setdefault(sheet_name, [0, 0]); c[0 if hit else 1] += 1
+
+    def reset(self):
+        with self.lock: self.history.clear(); self.pages.clear()
+
+@st.cache_resource
+def metrics(): return Metrics()
+
+def instrumented(op, rows=None):
+    """Time every call into the current rerun's metrics. rows(result, *args) gives the rows it moved."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            t = time.perf_counter(); ok = False
+            try:
+                res = fn(*args, **kwargs); ok = True
+                return res
+            finally:
+                n = 0
+                if ok and rows is not None:
+                    try: n = int(rows(res, *args))
+                    except Exception: pass
+                metrics().record(op, (time.perf_counter() - t) * 1000, n, not ok)
+        return inner
+    return wrap
+
+def frame_rows(res, *args): return len(res) if res is not None else 0
+
+def hist_quantile(hist, q):
+    """Upper bound in ms of the latency bucket holding quantile q (inf for the overflow bucket)."""
+    total = sum(hist); acc = 0
+    for i, n in enumerate(hist):
+        acc += n
+        if total and acc >= q * total: return float(LATENCY_BUCKETS_MS[i]) if i < len(LATENCY_BUCKETS_MS) else math.inf
+    return 0.0
+
+def ops_frame(ops):
+    """One row per instrumented op. Times are inclusive: get_inv's time also counts under load_data and sheets.*."""
+    rows = [{"Op": op, "Calls": o["calls"], "Errors": o["errors"], "Total ms": round(o["ms"], 1), "Avg ms": round(o["ms"] / o["calls"], 2) if o["calls"] else 0.0,
+             "p50 ≤ ms": hist_quantile(o["hist"], 0.5), "p95 ≤ ms": hist_quantile(o["hist"], 0.95), "Rows": o["rows"]} for op, o in ops.items()]
+    return pd.DataFrame(rows, columns=["Op", "Calls", "Errors", "Total ms", "Avg ms", "p50 ≤ ms", "p95 ≤ ms", "Rows"]).sort_values("Total ms", ascending=False)
+
+def api_totals(ops):
+    """(backend calls, rows moved, ms) over the sheets.* ops."""
+    io = [o for op, o in ops.items() if op.startswith("sheets.")]
+    return sum(o["calls"] for o in io), sum(o["rows"] for o in io), sum(o["ms"] for o in io)
+
+def run_summary(run):
+    calls, rows, ms = api_totals(run["ops"])
+    hits = sum(h for h, _ in run["cache"].values()); misses = sum(m for _, m in run["cache"].values())
+    return {"Started": datetime.fromtimestamp(run["start"]).strftime("%H:%M:%S"), "Page": run["page"], "Session": run["session"], "Wall ms": run.get("wall_ms"),
+            "API calls": calls, "Rows moved": rows, "API ms": round(ms, 1), "Cache hits": hits, "Cache misses": misses}
+
 # --- UNIVERSAL FILTER ---
-def render_filtered_table(df, key_prefix):
+PAGE_SIZES = [25, 50, 100, 250]
+PICK_LIMIT = 30  # columns with fewer distinct values filter by pick list, others by text search
+
+@st.cache_resource
+def table_views(): return {}
+
+@st.cache_resource
+def derived_frames(): return {}
+
+def derive(key, frames, build):
+    """build(*frames), reused while each input is the same frame object (shared frames are replaced, never edited), so tables built from it keep their column views."""
+    memo = derived_frames(); hit = memo.get(key)
+    if hit and len(hit[0]) == len(frames) and all(r() is f for r, f in zip(hit[0], frames)): return hit[1]
+    out = build(*frames); memo[key] = ([weakref.ref(f) for f in frames], out)
+    return out
+
+def column_view(df, col, key_prefix, version):
+    """
+    (string view, sorted distinct values) of a column, cached per table, data version and frame. Two frames
+    rendered under one key_prefix (e.g. different filters) never share views; the frame is held weakly.
+    """
+    views = table_views()
+    entry = views.get(key_prefix)
+    if version is None or entry is None or entry["ver"] != version or entry["df"]() is not df:
+        entry = {"ver": version, "df": weakref.ref(df), "cols": {}}
+        if version is not None: views[key_prefix] = entry
+    if col not in entry["cols"]:
+        view = df[col].astype(str)
+        entry["cols"][col] = (view, sorted(view.unique()) if view.nunique() < PICK_LIMIT else None)
+    return entry["cols"][col]
+
+@instrumented("render_filtered_table", rows=frame_rows)
+def render_filtered_table(df, key_prefix, version=None):
+    """
+    Filtered, paged table. Filters on several columns combine with AND; only the current page is sent
+    to the browser. Pass version (e.g. sheet_version + row count) to reuse column string views across reruns.
+    """
     if df.empty:
         st.info("No records found.")
         return df
+    mask = None
     with st.expander("🔍 Filter & Search Data", expanded=False):
-        c1, c2 = st.columns([1, 2])
-        all_cols = list(df.columns)
-        filter_col = c1.selectbox(f"Filter Column", ["All"] + all_cols, key=f"filt_col_{key_prefix}")
-        if filter_col != "All":
-            unique_vals = df[filter_col].astype(str).unique()
-            if len(unique_vals) < 30:
-                val = c2.selectbox(f"Select Value", unique_vals, key=f"filt_val_{key_prefix}")
-                df_filtered = df[df[filter_col].astype(str) == val]
+        filter_cols = st.multiselect("Filter Columns", list(df.columns), key=f"filt_cols_{key_prefix}")
+        for col in filter_cols:
+            view, choices = column_view(df, col, key_prefix, version)
+            if choices is not None:
+                vals = st.multiselect(f"{col} is", choices, key=f"filt_val_{key_prefix}_{col}")
+                m = view.isin(vals) if vals else None
             else:
-                val = c2.text_input(f"Search Value", key=f"filt_txt_{key_prefix}")
-                if val:
-                    df_filtered = df[df[filter_col].astype(str).str.contains(val, case=False, na=False)]
-                else:
-                    df_filtered = df
-        else:
-            df_filtered = df
-    st.dataframe(df_filtered, use_container_width=True)
+                val = st.text_input(f"{col} contains", key=f"filt_txt_{key_prefix}_{col}")
+                m = view.str.contains(val, case=False, na=False, regex=False) if val else None
+            if m is not None: mask = m if mask is None else mask & m
+    df_filtered = df if mask is None else df[mask.to_numpy()]
+    n = len(df_filtered)
+    c1, c2, c3 = st.columns([1, 1, 2])
+    size = c1.selectbox("Rows per page", PAGE_SIZES, key=f"page_size_{key_prefix}")
+    pages = max(1, math.ceil(n / size))
+    page = c2.number_input("Page", min_value=1, max_value=pages, value=1, step=1, key=f"page_{key_prefix}")
+    page = min(int(page), pages); lo = (page - 1) * size
+    c3.caption(f"Rows {min(lo + 1, n)}–{min(lo + size, n)} of {n}" + (f" (filtered from {len(df)})" if n != len(df) else ""))
+    st.dataframe(df_filtered.iloc[lo:lo + size], use_container_width=True)
     return df_filtered
 
+# --- SHEETS QUOTA ---
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+
+class SheetsError(Exception):
+    """A Sheets request that still failed after backing off. Shown to the user rather than an empty screen."""
+
+class QuotaExceeded(SheetsError):
+    """429 on every attempt. Google rejected the request before running it, so a write never landed."""
+
+class SheetsUnavailable(SheetsError):
+    """Server errors, timeouts or a dropped connection. A write may or may not have landed."""
+
+class TokenBucket:
+    """
+    burst tokens, refilled so that no 60 s window ever sees more than per_minute requests.
+    take() blocks until a token is free and returns the seconds it waited.
+    """
+    def __init__(self, per_minute, burst):
+        self.capacity = max(1, min(burst, per_minute - 1)); self.rate = max(per_minute - self.capacity, 1) / 60
+        self.tokens = float(self.capacity); self.stamp = time.monotonic(); self.lock = threading.Lock()
+
+    def take(self):
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate); self.stamp = now
+                if self.tokens >= 1: self.tokens -= 1; return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait); waited += wait
+
+class QuotaHTTPClient(gspread.http_client.HTTPClient):
+    """
+    gspread transport shared by every session. Reads and writes each pass a token bucket sized to the
+    quota, identical GETs in flight at the same time share one response, and retryable failures back
+    off exponentially with jitter before surfacing as a SheetsError. Writes are only retried on 429:
+    anything else may already have been applied.
+    """
+    def __init__(self, auth, session=None, quota=None):
+        super().__init__(auth, session)
+        self.quota = q = {**SHEETS_QUOTA, **(quota or {})}; self.timeout = q["timeout"]
+        self.buckets = {"read": TokenBucket(q["reads_per_minute"], q["burst"]), "write": TokenBucket(q["writes_per_minute"], q["burst"])}
+        self.lock = threading.Lock(); self.inflight = {}
+
+    def request(self, method, endpoint, params=None, data=None, json=None, files=None, headers=None):
+        call = functools.partial(self.send, method, endpoint, params=params, data=data, json=json, files=files, headers=headers)
+        if method.upper() != "GET": return call()
+        key = (endpoint, repr(sorted(params.items()) if isinstance(params, dict) else params))
+        with self.lock:
+            flight = self.inflight.get(key); leader = flight is None
+            if leader: flight = self.inflight[key] = {"done": threading.Event()}
+        if not leader:
+            flight["done"].wait(); metrics().record("sheets.coalesced", 0.0)
+            if "error" in flight: raise flight["error"]
+            return flight["response"]
+        try:
+            flight["response"] = call(); return flight["response"]
+        except Exception as e: flight["error"] = e; raise
+        finally:
+            with self.lock: self.inflight.pop(key, None)
+            flight["done"].set()
+
+    def send(self, method, endpoint, **kw):
+        kind = "read" if method.upper() == "GET" else "write"; q = self.quota
+        for attempt in range(q["retries"] + 1):
+            waited = self.buckets[kind].take()
+            if waited: metrics().record(f"sheets.throttled_{kind}", waited * 1000)
+            retry_after = None
+            try: return super().request(method, endpoint, **kw)
+            except gspread.exceptions.APIError as e:
+                code = e.response.status_code
+                if code not in RETRYABLE_STATUS: raise
+                err = e; retry_after = e.response.headers.get("Retry-After")
+                if kind == "write" and code != 429: break
+            except requests.exceptions.RequestException as e:
+                err = e
+                if kind == "write": break
+            if attempt == q["retries"]: break
+            delay = min(q["max_backoff"], 2 ** attempt) * (0.5 + random.random() / 2)
+            if retry_after and retry_after.isdigit(): delay = max(delay, float(retry_after))
+            metrics().record(f"sheets.backoff_{kind}", delay * 1000); time.sleep(delay)
+        if isinstance(err, gspread.exceptions.APIError) and err.response.status_code == 429:
+            raise QuotaExceeded("Google Sheets quota exceeded, try again in a minute") from err
+        raise SheetsUnavailable(f"Google Sheets is not responding ({type(err).__name__}), try again shortly") from err
+
+def sheets_quota():
+    q = dict(SHEETS_QUOTA)
+    try: q.update({k: float(v) for k, v in st.secrets.get("sheets_quota", {}).items()})
+    except Exception: pass
+    q["retries"] = int(q["retries"])
+    return q
+
 # --- CONNECTION ---
 @st.cache_resource
+@instrumented("connect_to_gsheet")
 def connect_to_gsheet():
     scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
     if "gcp_service_account" not in st.secrets:
@@ -123,7 +432,7 @@ def connect_to_gsheet():
         st.stop()
     creds_dict = st.secrets["gcp_service_account"]
     creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-    client = gspread.authorize(creds)
+    client = gspread.authorize(creds, http_client=functools.partial(QuotaHTTPClient, quota=sheets_quota()))
     return client.open("nexus_erp_db")
 
 USERS = {"owner": "admin123", "manager": "user123"}
@@ -144,84 +453,767 @@ def check_login():
     return True
 
 # --- BACKEND FUNCTIONS ---
+COLUMN_ALIASES = {
+    "nsp code": "NSP Code", "nspcode": "NSP Code", "code": "NSP Code",
+    "product name": "Product Name", "productname": "Product Name",
+    "units": "Qty", "quantity": "Qty", "qty": "Qty",
+    "cost price": "Cost Price", "cp": "Cost Price",
+    "selling price": "Selling Price", "sp": "Selling Price", "mrp": "Selling Price",
+    "vendor name": "Vendor Name", "vendor": "Vendor Name",
+    "invoice no": "Invoice No", "inv": "Invoice No",
+    "location": "Location", "loc": "Location",
+    "quote id": "Quote ID", "order no": "Order No", "payment id": "Payment ID",
+    "salesman": "Salesman", "sales man": "Salesman",
+    "status": "Status", "mode": "Mode",
+    "cust gst": "Customer GST", "gstin": "Customer GST",
+    "address": "Address", "cust address": "Address"
+}
+
+def canonical_col(c):
+    clean = str(c).lower().strip().replace("_", " ")
+    for k, v in COLUMN_ALIASES.items():
+        if k == clean or k == clean.replace(" ", ""): return v
+    return c
+
 def normalize_cols(df):
+    """Canonical column names. The outbox's bookkeeping column (OUTBOX_ID_COL) is dropped."""
     if df.empty: return df
-    corrections = {
-        "nsp code": "NSP Code", "nspcode": "NSP Code", "code": "NSP Code",
-        "product name": "Product Name", "productname": "Product Name",
-        "units": "Qty", "quantity": "Qty", "qty": "Qty",
-        "cost price": "Cost Price", "cp": "Cost Price",
-        "selling price": "Selling Price", "sp": "Selling Price", "mrp": "Selling Price",
-        "vendor name": "Vendor Name", "vendor": "Vendor Name",
-        "invoice no": "Invoice No", "inv": "Invoice No",
-        "location": "Location", "loc": "Location",
-        "quote id": "Quote ID", "order no": "Order No", "payment id": "Payment ID",
-        "salesman": "Salesman", "sales man": "Salesman",
-        "status": "Status", "mode": "Mode",
-        "cust gst": "Customer GST", "gstin": "Customer GST",
-        "address": "Address", "cust address": "Address"
-    }
-    new_cols = {}
-    for c in df.columns:
-        clean = str(c).lower().strip().replace("_", " ")
-        matched = False
-        for k, v in corrections.items():
-            if k == clean or k == clean.replace(" ", ""):
-                new_cols[c] = v; matched = True; break
-    return df.rename(columns=new_cols)
-
-@st.cache_data(ttl=10)
+    return df.rename(columns={c: canonical_col(c) for c in df.columns}).drop(columns=OUTBOX_ID_COL, errors="ignore")
+
+# Column types per sheet, applied once per load by apply_schema(). Undeclared columns stay text.
+SHEET_SCHEMAS = {
+    "Products": {"NSP Code": "text", "Product Name": "text", "Cost Price": "num", "Selling Price": "num",
+                 "Op_Shop": "num", "Op_Terrace": "num", "Op_Godown": "num"},
+    "Sales": {"Invoice No": "text", "NSP Code": "text", "Product Name": "text", "Customer Name": "text", "Phone": "text",
+              "Qty": "num", "Price": "num", "Discount": "num", "Total": "num", "Paid": "num", "Balance": "num",
+              "Location": "category", "Salesman": "category", "Mode": "category", "Bill Type": "category"},
+    "Purchase": {"NSP Code": "text", "Product Name": "text", "Qty": "num", "Cost Price": "num", "Selling Price": "num",
+                 "Location": "category", "Vendor Name": "category"},
+    "Transfers": {"NSP Code": "text", "Qty": "num", "From_Loc": "category", "To_Loc": "category"},
+    "Vendor_Payments": {"Payment ID": "text", "Amount": "num", "Vendor Name": "category", "Status": "category"},
+    "Quotations": {"Quote ID": "text", "NSP Code": "text", "Product Name": "text", "Phone": "text",
+                   "Qty": "num", "Price": "num", "Total": "num"},
+    "Manufacturing": {"Order No": "text", "NSP Code": "text", "Product Name": "text", "Qty": "num", "Status": "category"},
+    "Receipts": {"Invoice No": "text", "Amount": "num", "Mode": "category", "Invoice Mode": "category"}
+}
+
+def apply_schema(sheet_name, df):
+    """Cast the columns SHEET_SCHEMAS declares for a sheet. Columns already of the right type are left alone."""
+    for col, kind in SHEET_SCHEMAS.get(sheet_name.removesuffix(ARCHIVE_SUFFIX), {}).items():
+        if col not in df.columns: continue
+        s = df[col]
+        if kind == "num": df[col] = to_num(s)
+        elif kind == "category":
+            if not isinstance(s.dtype, pd.CategoricalDtype): df[col] = s.fillna("").astype(str).astype("category")
+        elif not pd.api.types.is_string_dtype(s.dtype): df[col] = s.fillna("").astype(str)
+    return df
+
+def concat_typed(sheet_name, a, b):
+    """Append typed frame b to typed frame a without category columns falling back to object."""
+    df = pd.concat([a, b], ignore_index=True)
+    for col, kind in SHEET_SCHEMAS.get(sheet_name.removesuffix(ARCHIVE_SUFFIX), {}).items():
+        if kind != "category" or col not in df.columns or isinstance(df[col].dtype, pd.CategoricalDtype): continue
+        if col in a.columns and col in b.columns:
+            df[col] = pd.Categorical(pd.api.types.union_categoricals([a[col], b[col]], ignore_order=True))
+        else: df[col] = df[col].fillna("").astype(str).astype("category")
+    return df
+
+# --- STORAGE BACKENDS ---
+def norm_header(h): return str(h).lower().replace(" ", "").strip()
+
+def col_a1(idx, start_row=1): return gspread.utils.rowcol_to_a1(start_row, idx).rstrip("0123456789")
+
+def row_ranges(rows):
+    """Contiguous (first, last) runs of sheet row numbers, bottom-most run first."""
+    ranges = []
+    for r in sorted(set(rows)):
+        if ranges and r == ranges[-1][1] + 1: ranges[-1][1] = r
+        else: ranges.append([r, r])
+    return [tuple(x) for x in reversed(ranges)]
+
+class SheetMeta:
+    """A sheet's header row precompiled into a normalized name -> column map (plus its worksheet handle, if any)."""
+    def __init__(self, ws, headers):
+        self.ws = ws; self.headers = headers
+        self.keys = [norm_header(h) for h in headers]
+        self.cols = {}; self.checked = set()
+        for i, k in enumerate(self.keys): self.cols.setdefault(k, i + 1)
+
+    def col(self, *names):
+        for n in names:
+            if n in self.cols: return self.cols[n]
+        return None
+
+    def named(self, col_name):
+        """1-based index of the header that normalize_cols maps to col_name."""
+        for i, h in enumerate(self.headers):
+            if canonical_col(h) == col_name: return i + 1
+        return None
+
+    def product_cols(self):
+        return self.col("productname", "product_name"), self.col("costprice", "cp"), self.col("sellingprice", "sp", "mrp")
+
+    def row_for(self, data_dict):
+        by_key = {}
+        for k, v in data_dict.items(): by_key.setdefault(norm_header(k), str(v))
+        return [by_key.get(k, "") for k in self.keys]
+
+class StorageBackend:
+    """
+    Everything the app reads or writes goes through one of these. Sheet and column names are the
+    Google Sheet ones; row numbers are sheet rows (header = 1). Methods raise on failure.
+    """
+    def read(self, sheet_name): raise NotImplementedError  # (DataFrame, watermark for read_tail)
+    def read_tail(self, sheet_name, watermark): return None  # (rows appended since watermark, new watermark); None = reload
+    def append(self, sheet_name, rows): raise NotImplementedError
+    def update_products(self, items): raise NotImplementedError  # items: (code, name, cp, sp); returns the codes not in Products
+    def update_product(self, code, name, cp, sp): return not self.update_products([(code, name, cp, sp)])  # False when code is not in Products
+    def settle(self, inv_no, amt_paid, rows=None): raise NotImplementedError  # False when the invoice has no rows
+    def column_values(self, sheet_name, col_name): raise NotImplementedError  # [] when the sheet or column is missing
+    def read_rows(self, sheet_name, offset, limit): raise NotImplementedError  # raw data rows offset..offset+limit-1; empty when missing
+    def row_count(self, sheet_name): raise NotImplementedError  # data rows, blank ones included (may overcount); 0 when missing
+    def delete_row(self, sheet_name, row_idx): raise NotImplementedError
+    def delete_where(self, sheet_name, id_col, id_val, rows=None): raise NotImplementedError  # False when nothing matched
+    def write_column(self, sheet_name, col_name, values): raise NotImplementedError  # first len(values) data rows; False when the column is missing
+    def delete_rows_at(self, sheet_name, rows): raise NotImplementedError  # sheet row numbers
+    # rows: sheet rows the row index expects to hold the id. A hint only; backends check it before relying on it.
+
+class SheetsBackend(StorageBackend):
+    """
+    Google Sheets through gspread. Worksheet handles and header maps are cached per sheet name, and so
+    is a sheet's absence (for FULL_RELOAD_SECS, or until the app writes it): archive sheets don't exist
+    before the first period close, and every Dashboard rerun would otherwise spend a read finding that out.
+    """
+    def __init__(self, sh):
+        self.sh = sh; self.handles = {}; self.missing = {}  # sheet name -> when worksheet() last found it absent
+
+    def sheet(self, sheet_name, create_with=None):
+        """Cached SheetMeta for a sheet. Missing sheets (or empty header rows) are created from create_with."""
+        meta = self.handles.get(sheet_name)
+        if meta is None:
+            if create_with is None and time.time() - self.missing.get(sheet_name, -math.inf) < FULL_RELOAD_SECS:
+                raise gspread.exceptions.WorksheetNotFound(sheet_name)
+            try: ws = self.sh.worksheet(sheet_name)
+            except gspread.exceptions.WorksheetNotFound:
+                if create_with is None: self.missing[sheet_name] = time.time(); raise
+                ws = self.sh.add_worksheet(sheet_name, 100, 20); ws.append_row(list(create_with))
+            self.missing.pop(sheet_name, None)
+            headers = ws.row_values(1)
+            if not headers and create_with is not None: headers = list(create_with); ws.append_row(headers)
+            meta = self.handles[sheet_name] = SheetMeta(ws, headers)
+        return meta
+
+    def forget(self, sheet_name): self.handles.pop(sheet_name, None)
+
+    def sheet_for_keys(self, sheet_name, keys):
+        """sheet(), re-reading the header row once if the data carries columns the cached headers don't know."""
+        meta = self.sheet(sheet_name, create_with=keys)
+        unknown = {norm_header(k) for k in keys} - set(meta.cols) - meta.checked
+        if unknown:
+            self.forget(sheet_name); meta = self.sheet(sheet_name, create_with=keys)
+            if norm_header(OUTBOX_ID_COL) in unknown and norm_header(OUTBOX_ID_COL) not in meta.cols:
+                # The outbox's own id column is the one unknown column worth adding to an existing header row:
+                # queued rows can't be told apart from rows that already landed without it.
+                n = len(meta.headers)
+                if meta.ws.col_count <= n: meta.ws.add_cols(1)
+                meta.ws.update_cell(1, n + 1, OUTBOX_ID_COL)
+                self.forget(sheet_name); meta = self.sheet(sheet_name, create_with=keys)
+            meta.checked |= unknown
+        return meta
+
+    @staticmethod
+    def records(headers, rows):
+        """Raw cell text padded to the header width; load_data types the columns from SHEET_SCHEMAS."""
+        width = len(headers)
+        return pd.DataFrame([(r + [""] * width)[:width] for r in rows], columns=headers)
+
+    def read(self, sheet_name):
+        """Whole sheet. The watermark is (data row count, last row as raw text) for read_tail."""
+        meta = self.sheet(sheet_name)
+        values = meta.ws.get_all_values()
+        if not values: return pd.DataFrame(), None
+        headers, rows = values[0], values[1:]
+        if headers != meta.headers: self.forget(sheet_name); meta = self.sheet(sheet_name)
+        width = len(headers)
+        return self.records(headers, rows), (len(rows), (values[-1] + [""] * width)[:width])
+
+    def read_tail(self, sheet_name, watermark):
+        """
+        One ranged read from the last known row to the end. If that row no longer matches (rows were
+        deleted or edited above it) the caller has to reload the whole sheet.
+        """
+        if watermark is None: return None
+        known, last = watermark
+        meta = self.sheet(sheet_name); width = len(meta.headers)
+        values = [(r + [""] * width)[:width] for r in meta.ws.get(f"A{known + 1}:{col_a1(width)}")]
+        if not values or values[0] != last: return None
+        return self.records(meta.headers, values[1:]), (known + len(values) - 1, values[-1])
+
+    def append(self, sheet_name, rows):
+        keys = list(dict.fromkeys(k for d in rows for k in d))
+        try:
+            meta = self.sheet_for_keys(sheet_name, keys)
+            meta.ws.append_rows([meta.row_for(d) for d in rows])
+        except gspread.exceptions.APIError as e:
+            # 400/404 means the cached handle or header row no longer matches the sheet: refetch once and retry.
+            self.forget(sheet_name)
+            if e.response.status_code not in (400, 404): raise
+            meta = self.sheet(sheet_name, create_with=keys)
+            meta.ws.append_rows([meta.row_for(d) for d in rows])
+
+    def column_values(self, sheet_name, col_name):
+        try: meta = self.sheet(sheet_name)
+        except gspread.exceptions.WorksheetNotFound: return []
+        idx = meta.named(col_name)
+        return meta.ws.col_values(idx)[1:] if idx else []
+
+    def read_rows(self, sheet_name, offset, limit):
+        """One bounded ranged read of data rows, for streaming a sheet without holding all of it."""
+        try: meta = self.sheet(sheet_name)
+        except gspread.exceptions.WorksheetNotFound: return pd.DataFrame()
+        if not meta.headers: return pd.DataFrame()
+        return self.records(meta.headers, meta.ws.get(f"A{offset + 2}:{col_a1(len(meta.headers))}{offset + limit + 1}"))
+
+    def row_count(self, sheet_name):
+        """Grid rows below the header from fresh sheet metadata: ranged reads drop trailing blank rows, the grid doesn't."""
+        try: return max(self.sh.worksheet(sheet_name).row_count - 1, 0)
+        except gspread.exceptions.WorksheetNotFound: return 0
+
+    def update_products(self, items):
+        """Name, Cost and Selling Price for any number of products: one col_values, one batch_update."""
+        try:
+            meta = self.sheet("Products"); ws = meta.ws
+            row_of = {}
+            for r, c in enumerate(ws.col_values(meta.named("NSP Code"))[1:], start=2): row_of.setdefault(str(c), r)
+            cols = meta.product_cols(); updates = []; missing = []
+            for code, name, cp, sp in items:
+                row = row_of.get(str(code))
+                if row is None: missing.append(code); continue
+                updates += [{"range": gspread.utils.rowcol_to_a1(row, i), "values": [[v]]} for i, v in zip(cols, (name, float(cp), float(sp))) if i]
+            if updates: ws.batch_update(updates, value_input_option="USER_ENTERED")
+            return missing
+        except Exception: self.forget("Products"); raise
+
+    @staticmethod
+    def cells_at(ws, cols, rows):
+        """{col: {row: text}} for the given columns at the given sheet rows, in one batch_get."""
+        runs = row_ranges(rows)
+        got = iter(ws.batch_get([f"{col_a1(i)}{first}:{col_a1(i)}{last}" for i in cols for first, last in runs]))
+        out = {i: {} for i in cols}
+        for i in cols:
+            for first, last in runs:
+                vals = next(got)
+                for r in range(first, last + 1):
+                    j = r - first; out[i][r] = vals[j][0] if j < len(vals) and vals[j] else ""
+        return out
+
+    def hinted(self, ws, id_idx, id_val, cols, rows):
+        """cells_at() for rows from the row index, or None if any of them no longer holds id_val."""
+        if not rows: return None
+        cells = self.cells_at(ws, tuple(dict.fromkeys((id_idx,) + tuple(cols))), rows)
+        return cells if all(str(cells[id_idx][r]) == str(id_val) for r in rows) else None
+
+    def settle(self, inv_no, amt_paid, rows=None):
+        """
+        One batch_get of Invoice No/Paid/Balance, one batch_update for every line of the invoice. With
+        indexed rows only those cells are read; the whole columns only when the hint turns out stale.
+        """
+        try:
+            meta = self.sheet("Sales"); ws = meta.ws
+            idx_inv = meta.named("Invoice No")
+            idx_paid = meta.headers.index("Paid") + 1
+            idx_bal = meta.headers.index("Balance") + 1
+            cells = self.hinted(ws, idx_inv, inv_no, (idx_paid, idx_bal), rows)
+            if cells is None:
+                inv_vals, paid_vals, bal_vals = ws.batch_get([f"{col_a1(i)}1:{col_a1(i)}" for i in (idx_inv, idx_paid, idx_bal)])
+                cell = lambda vals, r: vals[r - 1][0] if len(vals) >= r and vals[r - 1] else ""
+                rows = [r for r in range(2, len(inv_vals) + 1) if str(cell(inv_vals, r)) == str(inv_no)]
+                cells = {i: {r: cell(vals, r) for r in rows} for i, vals in ((idx_paid, paid_vals), (idx_bal, bal_vals))}
+            if not rows: return False
+            updates = []
+            for r in rows:
+                updates.append({"range": gspread.utils.rowcol_to_a1(r, idx_paid), "values": [[safe_float(cells[idx_paid][r]) + amt_paid]]})
+                updates.append({"range": gspread.utils.rowcol_to_a1(r, idx_bal), "values": [[safe_float(cells[idx_bal][r]) - amt_paid]]})
+            ws.batch_update(updates, value_input_option="USER_ENTERED")
+            return True
+        except Exception: self.forget("Sales"); raise
+
+    def delete_rows(self, ws, rows):
+        """Delete sheet rows in one spreadsheet batch_update, one deleteDimension request per contiguous range."""
+        reqs = [{"deleteDimension": {"range": {"sheetId": ws.id, "dimension": "ROWS", "startIndex": first - 1, "endIndex": last}}} for first, last in row_ranges(rows)]
+        if reqs: self.sh.batch_update({"requests": reqs})
+
+    def delete_row(self, sheet_name, row_idx):
+        try: self.sheet(sheet_name).ws.delete_rows(row_idx)
+        except Exception: self.forget(sheet_name); raise
+
+    def delete_where(self, sheet_name, id_col, id_val, rows=None):
+        """Delete every row whose id_col equals id_val. Other columns are never matched. Indexed rows are checked, not searched."""
+        try:
+            meta = self.sheet(sheet_name); idx = meta.named(id_col)
+            if not idx: return False
+            if self.hinted(meta.ws, idx, id_val, (), rows) is None:
+                rows = [i + 1 for i, v in enumerate(meta.ws.col_values(idx)) if i > 0 and str(v) == str(id_val)]
+            if not rows: return False
+            self.delete_rows(meta.ws, rows)
+            return True
+        except Exception: self.forget(sheet_name); raise
+
+    def write_column(self, sheet_name, col_name, values):
+        """Overwrite the first len(values) data rows of a column in one batch_update."""
+        try:
+            meta = self.sheet(sheet_name); idx = meta.named(col_name)
+            if not idx: return False
+            if values: meta.ws.batch_update([{"range": f"{col_a1(idx)}2:{col_a1(idx)}{len(values) + 1}", "values": [[v] for v in values]}], value_input_option="USER_ENTERED")
+            return True
+        except Exception: self.forget(sheet_name); raise
+
+    def delete_rows_at(self, sheet_name, rows):
+        try: self.delete_rows(self.sheet(sheet_name).ws, rows)
+        except Exception: self.forget(sheet_name); raise
+
+class SqliteBackend(StorageBackend):
+    """
+    Local SQLite file with one table per sheet. Cells are stored and read back as text, like a RAW
+    Sheets write; lookup columns are indexed.
+    """
+    INDEXED = ("NSP Code", "Invoice No", "Quote ID", "Payment ID")
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path, check_same_thread=False); self.lock = threading.RLock()
+        self.db.execute("PRAGMA journal_mode=WAL")
+
+    @staticmethod
+    def q(name): return '"' + str(name).replace('"', '""') + '"'
+
+    def meta(self, table):
+        return SheetMeta(None, [r[1] for r in self.db.execute(f"PRAGMA table_info({self.q(table)})")])
+
+    def ensure(self, table, keys):
+        """Create the table, or add the columns it is missing, so every key in keys has a column."""
+        meta = self.meta(table)
+        if not meta.headers:
+            self.db.execute(f"CREATE TABLE {self.q(table)} ({', '.join(self.q(k) + ' TEXT' for k in keys)})")
+        else:
+            for k in keys:
+                if norm_header(k) not in meta.cols: self.db.execute(f"ALTER TABLE {self.q(table)} ADD COLUMN {self.q(k)} TEXT")
+        meta = self.meta(table)
+        for col_name in self.INDEXED:
+            idx = meta.named(col_name)
+            if idx: self.db.execute(f"CREATE INDEX IF NOT EXISTS {self.q('ix_' + table + '_' + col_name)} ON {self.q(table)} ({self.q(meta.headers[idx - 1])})")
+        return meta
+
+    def read(self, sheet_name):
+        """Whole table. The watermark is (row count, last rowid) for read_tail."""
+        return self.read_tail(sheet_name, (0, 0)) or (pd.DataFrame(), None)
+
+    def read_tail(self, sheet_name, watermark):
+        if watermark is None: return None
+        known, last_id = watermark
+        with self.lock:
+            if not self.meta(sheet_name).headers: return None
+            t = self.q(sheet_name)
+            if self.db.execute(f"SELECT COUNT(*) FROM {t} WHERE rowid <= ?", (last_id,)).fetchone()[0] != known: return None
+            df = pd.read_sql_query(f"SELECT rowid AS _rowid, * FROM {t} WHERE rowid > ? ORDER BY rowid", self.db, params=(last_id,)).fillna("")
+        ids = df.pop("_rowid")
+        return df, (known + len(df), int(ids.iloc[-1]) if len(ids) else last_id)
+
+    def append(self, sheet_name, rows):
+        keys = list(dict.fromkeys(k for d in rows for k in d))
+        with self.lock, self.db:
+            meta = self.ensure(sheet_name, keys)
+            cols = ", ".join(self.q(h) for h in meta.headers)
+            self.db.executemany(f"INSERT INTO {self.q(sheet_name)} ({cols}) VALUES ({', '.join('?' * len(meta.headers))})", [meta.row_for(d) for d in rows])
+
+    def column_values(self, sheet_name, col_name):
+        with self.lock:
+            meta = self.meta(sheet_name); idx = meta.named(col_name)
+            if not idx: return []
+            return [r[0] for r in self.db.execute(f"SELECT {self.q(meta.headers[idx - 1])} FROM {self.q(sheet_name)} ORDER BY rowid")]
+
+    def read_rows(self, sheet_name, offset, limit):
+        with self.lock:
+            if not self.meta(sheet_name).headers: return pd.DataFrame()
+            return pd.read_sql_query(f"SELECT * FROM {self.q(sheet_name)} ORDER BY rowid LIMIT ? OFFSET ?", self.db, params=(limit, offset)).fillna("")
+
+    def row_count(self, sheet_name):
+        with self.lock:
+            if not self.meta(sheet_name).headers: return 0
+            return self.db.execute(f"SELECT COUNT(*) FROM {self.q(sheet_name)}").fetchone()[0]
+
+    def update_products(self, items):
+        with self.lock, self.db:
+            meta = self.meta("Products"); idx_code = meta.named("NSP Code")
+            if not idx_code: return [code for code, *_ in items]
+            missing = []
+            for code, name, cp, sp in items:
+                hit = self.db.execute(f"SELECT rowid FROM Products WHERE {self.q(meta.headers[idx_code - 1])} = ? ORDER BY rowid LIMIT 1", (str(code),)).fetchone()
+                if not hit: missing.append(code); continue
+                sets = [(meta.headers[i - 1], str(v)) for i, v in zip(meta.product_cols(), (name, float(cp), float(sp))) if i]
+                if sets: self.db.execute(f"UPDATE Products SET {', '.join(self.q(c) + ' = ?' for c, _ in sets)} WHERE rowid = ?", [v for _, v in sets] + [hit[0]])
+            return missing
+
+    def settle(self, inv_no, amt_paid, rows=None):
+        with self.lock, self.db:
+            meta = self.meta("Sales"); idx_inv = meta.named("Invoice No")
+            if not idx_inv: return False
+            rows = self.db.execute(f"SELECT rowid, {self.q('Paid')}, {self.q('Balance')} FROM Sales WHERE {self.q(meta.headers[idx_inv - 1])} = ?", (str(inv_no),)).fetchall()
+            self.db.executemany(f"UPDATE Sales SET {self.q('Paid')} = ?, {self.q('Balance')} = ? WHERE rowid = ?", [(str(safe_float(p) + amt_paid), str(safe_float(b) - amt_paid), rid) for rid, p, b in rows])
+            return bool(rows)
+
+    def delete_row(self, sheet_name, row_idx):
+        with self.lock, self.db:
+            self.db.execute(f"DELETE FROM {self.q(sheet_name)} WHERE rowid = (SELECT rowid FROM {self.q(sheet_name)} ORDER BY rowid LIMIT 1 OFFSET ?)", (row_idx - 2,))
+
+    def delete_where(self, sheet_name, id_col, id_val, rows=None):
+        with self.lock, self.db:
+            meta = self.meta(sheet_name); idx = meta.named(id_col)
+            if not idx: return False
+            return self.db.execute(f"DELETE FROM {self.q(sheet_name)} WHERE {self.q(meta.headers[idx - 1])} = ?", (str(id_val),)).rowcount > 0
+
+    def write_column(self, sheet_name, col_name, values):
+        with self.lock, self.db:
+            meta = self.meta(sheet_name); idx = meta.named(col_name)
+            if not idx: return False
+            ids = [r[0] for r in self.db.execute(f"SELECT rowid FROM {self.q(sheet_name)} ORDER BY rowid LIMIT ?", (len(values),))]
+            self.db.executemany(f"UPDATE {self.q(sheet_name)} SET {self.q(meta.headers[idx - 1])} = ? WHERE rowid = ?", [(str(v), i) for v, i in zip(values, ids)])
+            return True
+
+    def delete_rows_at(self, sheet_name, rows):
+        with self.lock, self.db:
+            ids = [r[0] for r in self.db.execute(f"SELECT rowid FROM {self.q(sheet_name)} ORDER BY rowid")]
+            self.db.executemany(f"DELETE FROM {self.q(sheet_name)} WHERE rowid = ?", [(ids[r - 2],) for r in rows if 2 <= r < len(ids) + 2])
+
+# Backend I/O is timed per method, with rows read or written, so quota use shows up per page.
+BACKEND_IO_ROWS = {
+    "read": lambda res, *a: len(res[0]), "read_tail": lambda res, *a: len(res[0]) if res else 0,
+    "append": lambda res, self, sheet_name, rows: len(rows), "column_values": lambda res, *a: len(res), "read_rows": lambda res, *a: len(res),
+    "update_products": lambda res, self, items: len(items), "settle": None, "delete_row": None, "delete_where": None,
+    "write_column": lambda res, self, sheet_name, col_name, values: len(values), "delete_rows_at": lambda res, self, sheet_name, rows: len(rows),
+}
+
+def instrument_backend(cls, prefix):
+    for name, rows in BACKEND_IO_ROWS.items(): setattr(cls, name, instrumented(f"{prefix}.{name}", rows)(cls.__dict__[name]))
+
+instrument_backend(SheetsBackend, "sheets")
+
+def storage_config():
+    try: return dict(st.secrets.get("storage", {}))
+    except Exception: return {}
+
+@st.cache_resource
+def get_backend():
+    """Backend chosen by the [storage] secrets section: backend = "sqlite" (path = ...) or Google Sheets (default)."""
+    cfg = storage_config()
+    if cfg.get("backend") == "sqlite": return SqliteBackend(cfg.get("path", "nexus_erp.db"))
+    return SheetsBackend(connect_to_gsheet())
+
+APPEND_ONLY_SHEETS = ("Sales", "Purchase", "Transfers", "Logs", "Vendor_Payments", "Sales_Archive", "Purchase_Archive", "Transfers_Archive")
+FULL_RELOAD_SECS = 600  # append-only sheets are still re-read in full this often, to pick up edits made in the sheet itself
+
+class SheetCache:
+    """
+    Loaded frames keyed by sheet name, each with its own version counter. A write bumps only the
+    sheets it touched; otherwise a frame is reused until its SHEET_TTL runs out. Appends let the next
+    load fetch just the new rows; edits and deletes (edited=True) force a full reload.
+    """
+    def __init__(self, ttl):
+        self.ttl = ttl; self.lock = threading.Lock(); self.versions = {}; self.entries = {}; self.edited = set()
+
+    def version(self, sheet_name):
+        with self.lock: return self.versions.get(sheet_name, 0)
+
+    def bump(self, *sheet_names, edited=False):
+        with self.lock:
+            for s in sheet_names or set(self.entries) | set(self.versions):
+                self.versions[s] = self.versions.get(s, 0) + 1
+                if edited: self.edited.add(s)
+
+    def fresh(self, sheet_name):
+        with self.lock:
+            e = self.entries.get(sheet_name)
+            return e is not None and e[0] == self.versions.get(sheet_name, 0) and time.time() - e[1] < self.ttl.get(sheet_name, DEFAULT_TTL)
+
+    def get(self, sheet_name, loader):
+        now = time.time()
+        with self.lock:
+            v = self.versions.get(sheet_name, 0); e = self.entries.get(sheet_name)
+            incremental = e is not None and sheet_name not in self.edited and now - e[4] < FULL_RELOAD_SECS
+        hit = bool(e) and e[0] == v and now - e[1] < self.ttl.get(sheet_name, DEFAULT_TTL)
+        metrics().cache(sheet_name, hit)
+        if hit: return e[2]
+        df, wm, full = loader(sheet_name, (e[2], e[3]) if incremental else None)
+        with self.lock:
+            # A frame fetched while a write bumped the version may predate that write: serve it, don't keep it.
+            if self.versions.get(sheet_name, 0) == v:
+                self.entries[sheet_name] = (v, now, df, wm, now if full else e[4])
+                if full: self.edited.discard(sheet_name)
+        return df
+
+    def last(self, sheet_name):
+        """(frame, age in seconds) of the last frame loaded for a sheet however stale, or None."""
+        with self.lock: e = self.entries.get(sheet_name)
+        return (e[2], time.time() - e[1]) if e else None
+
+@st.cache_resource
+def sheet_cache():
+    ttl = dict(SHEET_TTL)
+    try: ttl.update({k: float(v) for k, v in st.secrets.get("cache_ttl", {}).items()})
+    except Exception: pass
+    return SheetCache(ttl)
+
+def read_sheet(sheet_name, prev=None):
+    """(frame, watermark, was_full_read). With a previous (frame, watermark), append-only sheets fetch only the new tail."""
+    be = get_backend()
+    if prev is not None and sheet_name in APPEND_ONLY_SHEETS:
+        tail = be.read_tail(sheet_name, prev[1])
+        if tail is not None:
+            new, wm = tail
+            return (concat_typed(sheet_name, prev[0], apply_schema(sheet_name, normalize_cols(new))) if len(new) else prev[0]), wm, False
+    df, wm = be.read(sheet_name)
+    return apply_schema(sheet_name, normalize_cols(df)), wm, True
+
+def fetch_sheet(sheet_name):
+    """Cached frame of a sheet. If Sheets fails the last frame loaded is served with a warning, never silently nothing."""
+    try: return sheet_cache().get(sheet_name, read_sheet)
+    except gspread.exceptions.WorksheetNotFound: return pd.DataFrame()
+    except Exception as e:
+        last = sheet_cache().last(sheet_name)
+        if last is None: st.error(f"❌ Could not load {sheet_name}: {e}"); return pd.DataFrame()
+        st.warning(f"⚠️ {sheet_name}: {e}. Showing data from {int(last[1] // 60)} min ago.")
+        return last[0]
+
+def sheet_version(sheet_name): return sheet_cache().version(sheet_name)
+
+@instrumented("load_data", rows=frame_rows)
 def load_data(sheet_name):
-    try:
-        sh = connect_to_gsheet(); ws = sh.worksheet(sheet_name)
-        df = pd.DataFrame(ws.get_all_records())
-        return normalize_cols(df)
-    except: return pd.DataFrame()
+    """
+    Sheet contents plus any appends still waiting in the outbox. The frame is the one the sheet cache
+    shares with every session: read-only. Derive views (filters, assign, merge) instead of writing to it.
+    """
+    df = fetch_sheet(sheet_name)
+    ob = get_outbox()
+    pend = ob.rows(sheet_name) if ob else []
+    if not pend: return df
+    out = concat_typed(sheet_name, df, apply_schema(sheet_name, normalize_cols(pd.DataFrame(pend))))
+    queued_frames()[sheet_name] = (weakref.ref(out), df)
+    return out
+
+@st.cache_resource
+def queued_frames(): return {}  # sheet -> (latest load_data frame with queued rows, the cached frame it starts with)
+
+def load_many(*sheet_names):
+    """load_data for several sheets, fetching the ones not already cached concurrently."""
+    cache = sheet_cache(); get_backend(); get_outbox()
+    cold = [s for s in sheet_names if not cache.fresh(s)]
+    if len(cold) > 1:
+        ctx = get_script_run_ctx()
+        with ThreadPoolExecutor(max_workers=len(cold), initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)) as pool:
+            list(pool.map(fetch_sheet, cold))
+    return {s: load_data(s) for s in sheet_names}
+
+def touch(*sheet_names, edited=False):
+    """Invalidate the cached frames of the sheets a write touched. edited=True for anything but an append."""
+    sheet_cache().bump(*sheet_names, edited=edited)
+
+def clear_cache(): sheet_cache().bump(edited=True)
+
+# --- WRITE-BEHIND OUTBOX ---
+IDEMPOTENCY_KEYS = {"Sales": "Invoice No", "Quotations": "Quote ID", "Vendor_Payments": "Payment ID", "Manufacturing": "Order No"}
+# Written on every queued row: business ids can repeat (PEND-<second> payments, hand-typed invoice numbers),
+# so they can't tell whether a retried batch already landed. Added to a sheet's header row on first use.
+OUTBOX_ID_COL = "Outbox ID"
+
+class Outbox:
+    """
+    Append-only JSONL journal of save_entries() batches, drained to the backend by a background thread.
+    A {"done": id} line marks a batch delivered; the file is truncated whenever nothing is pending, and
+    replayed on startup. Batches that may have reached the sheet before a failure ("suspect") are looked
+    up by the OUTBOX_ID_COL stamped on their rows before being written again. Each sheet drains and backs
+    off on its own; a batch the API rejects outright (see rejected()) goes to a dead-letter file instead
+    of being retried forever, so one bad batch never holds up the rest of the queue.
+    """
+    def __init__(self, backend, path, dead_path=None):
+        self.backend = backend; self.path = path; self.dead_path = dead_path or os.path.splitext(path)[0] + ".dead.jsonl"
+        self.lock = threading.Lock(); self.drained = threading.Condition(self.lock); self.wake = threading.Event()
+        self.pending = {}; self.suspect = set(); self.dead = []
+        self.failures = {}; self.retry_at = {}; self.errors = {}  # per sheet: consecutive failures, next attempt, last error
+        if os.path.exists(self.dead_path):
+            with open(self.dead_path, encoding="utf-8") as f:
+                for line in f:
+                    try: self.dead.append(json.loads(line))
+                    except ValueError: continue
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try: rec = json.loads(line)
+                    except ValueError: continue  # torn last line after a crash
+                    if "done" in rec: self.pending.pop(rec["done"], None)
+                    else: self.pending[rec["id"]] = rec
+            self.suspect = set(self.pending)
+        threading.Thread(target=self.run, name="outbox", daemon=True).start()
+        if self.pending: self.wake.set()
+
+    def journal(self, recs):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for rec in recs: f.write(json.dumps(rec, default=str) + "\n")
+            f.flush(); os.fsync(f.fileno())
+
+    def put(self, sheet_name, rows):
+        rid = uuid.uuid4().hex
+        rec = {"id": rid, "sheet": sheet_name, "rows": [{**r, OUTBOX_ID_COL: rid} for r in rows], "keys": [rid], "col": OUTBOX_ID_COL}
+        with self.lock:
+            self.journal([rec]); self.pending[rec["id"]] = rec
+        self.wake.set()
+
+    def rows(self, sheet_name):
+        with self.lock: return [r for rec in self.pending.values() if rec["sheet"] == sheet_name for r in rec["rows"]]
+
+    def flush(self, timeout=30):
+        """Block until everything queued so far has been delivered. False on timeout."""
+        self.wake.set()
+        end = time.time() + timeout
+        with self.lock:
+            while self.pending:
+                left = end - time.time()
+                if left <= 0: return False
+                self.drained.wait(left)
+        return True
+
+    @staticmethod
+    def rejected(e):
+        """A 4xx other than timeout/quota: the request itself is bad, so sending it again can't help."""
+        return isinstance(e, gspread.exceptions.APIError) and 400 <= e.response.status_code < 500 and e.response.status_code not in RETRYABLE_STATUS
+
+    def run(self):
+        while True:
+            with self.lock: due = min(self.retry_at.values(), default=None)
+            self.wake.wait(5 if due is None else max(0.1, due - time.time())); self.wake.clear()
+            self.drain()
+
+    def drain(self):
+        with self.lock: batch = list(self.pending.values())
+        by_sheet = {}
+        for rec in batch: by_sheet.setdefault(rec["sheet"], []).append(rec)
+        for sheet_name, recs in by_sheet.items():
+            if self.retry_at.get(sheet_name, 0) > time.time(): continue
+            try:
+                try: self.deliver(sheet_name, recs)
+                except Exception as e:
+                    if not self.rejected(e): raise
+                    # Send the batches one at a time, so only the one the API refuses is set aside.
+                    for rec in recs:
+                        try: self.deliver(sheet_name, [rec])
+                        except Exception as e1:
+                            if not self.rejected(e1): raise
+                            self.bury(rec, str(e1) or type(e1).__name__)
+            except Exception as e:
+                n = self.failures[sheet_name] = self.failures.get(sheet_name, 0) + 1
+                self.errors[sheet_name] = str(e) or type(e).__name__
+                self.retry_at[sheet_name] = time.time() + min(60, 2 ** n) * (0.5 + random.random())
+            else:
+                self.failures.pop(sheet_name, None); self.errors.pop(sheet_name, None); self.retry_at.pop(sheet_name, None)
+
+    def deliver(self, sheet_name, recs):
+        suspect = [r for r in recs if r["id"] in self.suspect and r["keys"]]
+        if suspect:
+            # Journals written before every row carried OUTBOX_ID_COL name no "col": those keys are business ids.
+            col = lambda r: r.get("col", IDEMPOTENCY_KEYS.get(sheet_name, OUTBOX_ID_COL))
+            seen = {c: {str(v) for v in self.backend.column_values(sheet_name, c)} for c in {col(r) for r in suspect}}
+            landed = [r for r in suspect if set(r["keys"]) <= seen[col(r)]]
+            self.finish(landed); recs = [r for r in recs if r not in landed]
+        if not recs: return
+        try: self.backend.append(sheet_name, [row for r in recs for row in r["rows"]])
+        except Exception as e:
+            # An APIError is a definite rejection; anything else (timeout, dropped connection) may have landed.
+            if not isinstance(e, (gspread.exceptions.APIError, QuotaExceeded)): self.suspect.update(r["id"] for r in recs)
+            raise
+        self.finish(recs)
+
+    def bury(self, rec, error):
+        """Move a rejected batch out of the queue into the dead-letter file."""
+        dead = {**rec, "error": error, "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        with self.lock:
+            with open(self.dead_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(dead, default=str) + "\n"); f.flush(); os.fsync(f.fileno())
+            self.dead.append(dead)
+        self.retire([rec])
+
+    def requeue(self):
+        """Put every dead-lettered batch back in the queue (after the sheet has been fixed)."""
+        with self.lock:
+            recs = [{k: v for k, v in d.items() if k not in ("error", "at")} for d in self.dead]
+            self.journal(recs)
+            for rec in recs: self.pending[rec["id"]] = rec
+            self.dead = []; open(self.dead_path, "w").close()
+        self.retry_at.clear(); self.wake.set()
+
+    def discard_dead(self):
+        with self.lock: self.dead = []; open(self.dead_path, "w").close()
+
+    def finish(self, recs):
+        if not recs: return
+        touch(*{r["sheet"] for r in recs})  # before the rows leave `pending`, so reads never miss them
+        self.retire(recs)
+
+    def retire(self, recs):
+        with self.lock:
+            self.journal([{"done": r["id"]} for r in recs])
+            for r in recs: self.pending.pop(r["id"], None); self.suspect.discard(r["id"])
+            if not self.pending: open(self.path, "w").close()
+            self.drained.notify_all()
+
+@st.cache_resource
+def get_outbox():
+    """Write-behind queue, on by default for Google Sheets ([storage] write_behind = false to disable)."""
+    cfg = storage_config()
+    if not cfg.get("write_behind", cfg.get("backend") != "sqlite"): return None
+    return Outbox(get_backend(), cfg.get("outbox_path", "outbox.jsonl"), cfg.get("dead_letter_path"))
+
+def sync_outbox(timeout=30):
+    """Wait for queued appends to land before a read-modify-write on the backend."""
+    ob = get_outbox()
+    return ob is None or ob.flush(timeout)
+
+@st.cache_resource
+def row_edit_lock():
+    """
+    Held by every write that addresses existing rows by number (settle, deletes, period close), so none of
+    them runs while another shifts rows under it. Appends never move existing rows and don't take it.
+    """
+    return threading.Lock()
 
-def clear_cache(): load_data.clear()
+def require_synced(timeout=30):
+    """sync_outbox(), raising if queued appends still haven't landed: edits and deletes must not run ahead of them."""
+    if not sync_outbox(timeout): raise RuntimeError("queued writes have not reached the sheet yet, try again")
 
-def save_entry(sheet_name, data_dict):
+@instrumented("save_entries", rows=lambda res, sheet_name, rows: len(rows))
+def save_entries(sheet_name, rows):
+    """Append several dicts to one sheet in a single backend write (queued in the outbox when enabled)."""
+    if not rows: return True
     try:
-        sh = connect_to_gsheet()
-        try: ws = sh.worksheet(sheet_name)
-        except: ws = sh.add_worksheet(sheet_name, 100, 20); ws.append_row(list(data_dict.keys()))
-        headers = ws.row_values(1)
-        if not headers: ws.append_row(list(data_dict.keys()))
-        row_to_append = []
-        for h in headers:
-            val = ""
-            h_clean = h.lower().replace(" ", "").strip()
-            for k, v in data_dict.items():
-                if k.lower().replace(" ", "").strip() == h_clean: val = str(v); break
-            row_to_append.append(val)
-        ws.append_row(row_to_append)
-        clear_cache()
+        ob = get_outbox()
+        if ob: ob.put(sheet_name, rows)
+        else: get_backend().append(sheet_name, rows)
+        if sheet_name in STOCK_SHEETS:
+            snap = stock_snapshot()
+            for data_dict in rows: snap.apply(sheet_name, data_dict)
+        if sheet_name == "Sales": receivables().apply(rows); sales_rollup().apply(rows)
+        if not ob: touch(sheet_name)
         return True
     except Exception as e: st.error(f"Save Error: {e}"); return False
 
+def save_entry(sheet_name, data_dict): return save_entries(sheet_name, [data_dict])
+
+@instrumented("update_product_master")
 def update_product_master(code, name, cp, sp):
     """
     CRITICAL FIX: Checks if product exists. If yes, updates it. 
-    If NOT found (raises exception), creates it.
+    If NOT found, creates it.
     """
     try:
-        sh = connect_to_gsheet(); ws = sh.worksheet("Products")
-        try:
-            cell = ws.find(str(code))
-            # If we reach here, product exists -> UPDATE
-            headers = ws.row_values(1)
-            def get_col_idx(name_list):
-                for i, h in enumerate(headers):
-                    if h.lower().replace(" ","") in name_list: return i + 1
-                return None
-            idx_name = get_col_idx(["productname", "product_name"])
-            idx_cp = get_col_idx(["costprice", "cp"])
-            idx_sp = get_col_idx(["sellingprice", "sp", "mrp"])
-            if idx_name: ws.update_cell(cell.row, idx_name, name)
-            if idx_cp: ws.update_cell(cell.row, idx_cp, float(cp))
-            if idx_sp: ws.update_cell(cell.row, idx_sp, float(sp))
-        except Exception:
-            # If find() fails, product is new -> CREATE
+        require_synced()
+        if not get_backend().update_product(code, name, cp, sp):
             save_entry("Products", {
                 "NSP Code": code, 
                 "Product Name": name, 
@@ -229,51 +1221,85 @@ def update_product_master(code, name, cp, sp):
                 "Selling Price": sp, 
                 "Op_Shop": 0, "Op_Terrace": 0, "Op_Godown": 0
             })
-        clear_cache()
+        touch("Products", edited=True)
         return True
     except Exception as e: 
         st.error(f"Master Update Critical Fail: {e}")
         return False
-def update_balance(inv_no, amt_paid):
+
+@instrumented("update_balance")
+def update_balance(inv_no, amt_paid, mode=""):
     try:
-        sh = connect_to_gsheet(); ws = sh.worksheet("Sales")
-        cell = ws.find(str(inv_no))
-        if cell:
-            headers = ws.row_values(1)
-            idx_paid = headers.index("Paid") + 1
-            idx_bal = headers.index("Balance") + 1
-            cell_list = ws.findall(str(inv_no))
-            for cell in cell_list:
-                curr_paid = safe_float(ws.cell(cell.row, idx_paid).value)
-                curr_bal = safe_float(ws.cell(cell.row, idx_bal).value)
-                new_paid = curr_paid + amt_paid
-                new_bal = curr_bal - amt_paid
-                ws.update_cell(cell.row, idx_paid, new_paid)
-                ws.update_cell(cell.row, idx_bal, new_bal)
-            clear_cache(); return True
+        require_synced()
+        inv_rows = rows_for(fetch_sheet("Sales"), "Sales", inv_no)
+        with row_edit_lock(): ok = get_backend().settle(inv_no, amt_paid, rows=row_index("Sales").sheet_rows(inv_no))
+        if ok:
+            receivables().settle(inv_no, amt_paid); sales_rollup().settle(inv_rows, amt_paid)
+            if not inv_rows.empty: record_receipt(inv_no, amt_paid, mode, inv_rows)
+            touch("Sales", edited=True); return True
         else: return False
-    except: return False
+    except Exception as e: st.error(f"Settle Error: {e}"); return False
 
+@instrumented("delete_entry_by_row")
 def delete_entry_by_row(sheet_name, row_idx):
     try:
-        sh = connect_to_gsheet(); ws = sh.worksheet(sheet_name)
-        ws.delete_rows(row_idx)
-        clear_cache(); return True
+        require_synced()
+        with row_edit_lock(): get_backend().delete_row(sheet_name, row_idx)
+        invalidate_derived(sheet_name)
+        touch(sheet_name, edited=True); return True
     except Exception as e:
         st.error(f"Delete Error: {e}")
         return False
 
+@instrumented("delete_entry")
 def delete_entry(sheet_name, id_col, id_val):
     try:
-        sh = connect_to_gsheet(); ws = sh.worksheet(sheet_name)
-        cell = ws.find(str(id_val))
-        if cell:
-            cell_list = ws.findall(str(id_val))
-            rows_to_delete = sorted([c.row for c in cell_list], reverse=True)
-            for r in rows_to_delete: ws.delete_rows(r)
-            clear_cache(); return True
+        require_synced()
+        rows = row_index(sheet_name).sheet_rows(id_val) if IDEMPOTENCY_KEYS.get(sheet_name) == id_col else None
+        gone = rows_for(fetch_sheet("Sales"), "Sales", id_val).to_dict("records") if sheet_name == "Sales" and id_col == "Invoice No" else None
+        with row_edit_lock(): ok = get_backend().delete_where(sheet_name, id_col, id_val, rows=rows)
+        if ok:
+            if gone is not None: sales_rollup().apply(gone, -1)
+            invalidate_derived(sheet_name, keep=(sales_rollup(),) if gone is not None else ())
+            touch(sheet_name, edited=True); return True
         else: return False
-    except: return False
+    except Exception as e: st.error(f"Delete Error: {e}"); return False
+
+# --- ROW INDEX ---
+class RowIndex:
+    """Row positions of every id (IDEMPOTENCY_KEYS column) in one loaded frame. Frame row p is sheet row p + 2."""
+    def __init__(self, df, col):
+        self.df = df; self.n = len(df); self.col = col
+        self.pos = df.groupby(df[col].astype(str), sort=False).indices if col in df.columns and len(df) else {}
+
+    def positions(self, key): return [int(p) for p in self.pos.get(str(key), ())]
+
+    def sheet_rows(self, key): return [p + 2 for p in self.positions(key)]
+
+@st.cache_resource
+def row_index_holder(): return {}
+
+def row_index(sheet_name):
+    """RowIndex of the cached frame for a sheet, rebuilt only when the cache hands out a new frame."""
+    df = fetch_sheet(sheet_name); holder = row_index_holder()
+    idx = holder.get(sheet_name)
+    if idx is None or idx.df is not df: idx = holder[sheet_name] = RowIndex(df, IDEMPOTENCY_KEYS[sheet_name])
+    return idx
+
+def rows_for(df, sheet_name, key):
+    """
+    Rows of a frame with this id. The cached sheet frame, or load_data's frame of it plus queued rows, is looked
+    up by indexed positions (and a scan of the few queued rows); any other frame (history, a copy from before a
+    reload) is scanned, since the positions don't refer to its rows.
+    """
+    idx = row_index(sheet_name); col = idx.col
+    if col not in df.columns: return df.iloc[0:0]
+    q = queued_frames().get(sheet_name)
+    if df is not idx.df and not (q and q[0]() is df and q[1] is idx.df): return df[df[col].astype(str) == str(key)]
+    return df.iloc[idx.positions(key) + [idx.n + i for i, v in enumerate(df[col].iloc[idx.n:].astype(str)) if v == str(key)]]
+
+def line_items(rows, discount=True):
+    return [{"Product Name": r['Product Name'], "NSP Code": r['NSP Code'], "Qty": r['Qty'], "Price": r['Price'], "Discount": r.get('Discount', 0) if discount else 0} for r in rows.to_dict("records")]
 
 def log_action(act, det):
     try:
@@ -281,119 +1307,679 @@ def log_action(act, det):
     except: pass
 
 # --- INVENTORY ENGINE ---
-def get_inv():
-    p = load_data("Products")
-    if p.empty: return pd.DataFrame()
-    p['Selling Price'] = p.get('Selling Price', 0).apply(safe_float)
-    p['Cost Price'] = p.get('Cost Price', 0).apply(safe_float)
-    p['Clean'] = p['NSP Code'].astype(str).str.strip().str.lower()
-    
-    for loc in LOCATIONS: p[loc] = 0.0
-    for loc, col_name in OPENING_BAL_COLS.items():
-        if col_name in p.columns: p[loc] += p[col_name].apply(safe_float)
+def clean_code(codes):
+    return codes.astype(str).str.strip().str.lower()
 
-    pu = load_data("Purchase")
+def stock_movements(pu, sa, tr):
+    """One signed row (Clean, Location, Qty) per stock movement: purchases in, sales out, transfers out+in."""
+    parts = []
     if not pu.empty and 'Location' in pu.columns:
-        pu['Clean'] = pu['NSP Code'].astype(str).str.strip().str.lower()
-        pu['Qty'] = pu['Qty'].apply(safe_float)
-        pu_grp = pu.groupby(['Clean', 'Location'])['Qty'].sum().reset_index()
-        for i, row in pu_grp.iterrows():
-            if row['Location'] in LOCATIONS:
-                p.loc[p['Clean'] == row['Clean'], row['Location']] += row['Qty']
-
-    sa = load_data("Sales")
+        parts.append(pd.DataFrame({'Clean': clean_code(pu['NSP Code']), 'Location': pu['Location'], 'Qty': to_num(pu['Qty'])}))
     if not sa.empty and 'Location' in sa.columns:
-        sa['Clean'] = sa['NSP Code'].astype(str).str.strip().str.lower()
-        sa['Qty'] = sa['Qty'].apply(safe_float)
-        sa_grp = sa.groupby(['Clean', 'Location'])['Qty'].sum().reset_index()
-        for i, row in sa_grp.iterrows():
-            if row['Location'] in LOCATIONS:
-                p.loc[p['Clean'] == row['Clean'], row['Location']] -= row['Qty']
-
-    tr = load_data("Transfers")
-    if not tr.empty:
-        tr['Clean'] = tr['NSP Code'].astype(str).str.strip().str.lower()
-        tr['Qty'] = tr['Qty'].apply(safe_float)
-        for i, row in tr.iterrows():
-            if row['From_Loc'] in LOCATIONS and row['To_Loc'] in LOCATIONS:
-                p.loc[p['Clean'] == row['Clean'], row['From_Loc']] -= row['Qty']
-                p.loc[p['Clean'] == row['Clean'], row['To_Loc']] += row['Qty']
-
-    p['Total Stock'] = p[LOCATIONS].sum(axis=1)
-    mask_cp_0 = (p['Cost Price'] == 0) & (p['Selling Price'] > 0)
-    p.loc[mask_cp_0, 'Cost Price'] = p.loc[mask_cp_0, 'Selling Price'] / 3.3
-    return p
+        parts.append(pd.DataFrame({'Clean': clean_code(sa['NSP Code']), 'Location': sa['Location'], 'Qty': -to_num(sa['Qty'])}))
+    if not tr.empty and 'From_Loc' in tr.columns and 'To_Loc' in tr.columns:
+        tr = tr[tr['From_Loc'].isin(LOCATIONS) & tr['To_Loc'].isin(LOCATIONS)]
+        clean = clean_code(tr['NSP Code']); qty = to_num(tr['Qty'])
+        parts.append(pd.DataFrame({'Clean': clean, 'Location': tr['From_Loc'], 'Qty': -qty}))
+        parts.append(pd.DataFrame({'Clean': clean, 'Location': tr['To_Loc'], 'Qty': qty}))
+    if not parts: return pd.DataFrame({'Clean': pd.Series(dtype=str), 'Location': pd.Series(dtype=str), 'Qty': pd.Series(dtype=float)})
+    mv = pd.concat(parts, ignore_index=True)
+    return mv[mv['Location'].isin(LOCATIONS)]
+
+def stock_ledger(mv):
+    """Net movement per Clean code (index) and location (columns) in a single groupby pass."""
+    if mv.empty: return pd.DataFrame(columns=LOCATIONS, dtype=float)
+    return mv.groupby(['Clean', 'Location'], observed=True)['Qty'].sum().unstack('Location').reindex(columns=LOCATIONS).fillna(0.0)
+
+@st.cache_resource
+def inventory_holder(): return {}
+
+@instrumented("get_inv", rows=frame_rows)
+def get_inv():
+    """
+    Products with stock per location, Total Stock and the Cost Price fallback. Built once per Products
+    frame and stock ledger, and shared by every session: read-only, like load_data frames.
+    """
+    data = load_many("Products", *STOCK_SHEETS)
+    p = data["Products"]
+    if p.empty: return pd.DataFrame()
+    snap = stock_snapshot()
+    snap.sync(p, {s: data[s] for s in STOCK_SHEETS})
+    ledger = snap.ledger(); holder = inventory_holder()
+    built = holder.get("inv")
+    if built and built[0] is p and built[1] is ledger: return built[2]
+
+    num = lambda c: to_num(p[c]) if c in p.columns else pd.Series(0.0, index=p.index)
+    sp = num('Selling Price'); cp = num('Cost Price'); clean = clean_code(p['NSP Code'])
+    net = ledger.reindex(clean).fillna(0.0)
+    stock = {loc: num(OPENING_BAL_COLS[loc]) + net[loc].to_numpy() for loc in LOCATIONS}
+    inv = p.assign(**{'Selling Price': sp, 'Cost Price': cp, 'Clean': clean}, **stock)
+    inv['Total Stock'] = inv[LOCATIONS].sum(axis=1)
+    inv['Cost Price'] = cp.mask((cp == 0) & (sp > 0), sp / 3.3)
+    holder["inv"] = (p, ledger, inv)
+    return inv
+
+# --- SYNCED CACHES ---
+class SyncedCache:
+    """
+    A process-wide aggregate over the sheets in SHEETS, shared by every session. Writers patch it as they
+    save; sync() rebuilds it only when a checksum in self.sums no longer matches the loaded frames, and
+    invalidate() empties the sums to force that. Patches arriving before the first sync are dropped.
+    """
+    SHEETS = ()
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sums = {}; self._frame = None
+
+    def invalidate(self):
+        with self.lock: self.sums = {}
+
+    def bump(self, key, *deltas):
+        """Under self.lock: shift the checksum under key by a patch's deltas, so the next sync still matches."""
+        self.sums[key] = tuple(a + d if isinstance(a, int) else round(a + d, 6) for a, d in zip(self.sums[key], deltas))
+        self._frame = None
+
+def derived_caches(): return (stock_snapshot(), receivables(), sales_rollup())
+
+def invalidate_derived(sheet_name=None, keep=()):
+    """Make every cache built from sheet_name (all of them when None), except those in keep, rebuild on next use."""
+    for c in derived_caches():
+        if c not in keep and (sheet_name is None or sheet_name in c.SHEETS): c.invalidate()
+
+# --- STOCK SNAPSHOT ---
+STOCK_SHEETS = ("Purchase", "Sales", "Transfers")
+
+def movement_checksum(df):
+    if df.empty: return (0, 0.0)
+    return (len(df), round(float(to_num(df['Qty']).sum()), 6) if 'Qty' in df.columns else 0.0)
+
+def opening_checksum(p):
+    cols = [c for c in OPENING_BAL_COLS.values() if c in p.columns]
+    return (len(p), round(float(sum(to_num(p[c]).sum() for c in cols)), 6))
+
+class StockSnapshot(SyncedCache):
+    """Stock per (Clean code, Location): Products openings plus net movements. save_entry patches it with each movement."""
+    SHEETS = ("Products",) + STOCK_SHEETS
+
+    def __init__(self):
+        super().__init__()
+        self.net = {}; self.opening = {}
+
+    def sync(self, p, frames):
+        with self.lock:
+            op_sum = opening_checksum(p)
+            if self.sums.get("Products") != op_sum:
+                self.opening = {}
+                for loc, col_name in OPENING_BAL_COLS.items():
+                    if col_name not in p.columns: continue
+                    for clean, qty in to_num(p[col_name]).groupby(clean_code(p['NSP Code'])).sum().items():
+                        self.opening[(clean, loc)] = qty
+                self.sums["Products"] = op_sum
+            sums = {s: movement_checksum(frames[s]) for s in STOCK_SHEETS}
+            if any(self.sums.get(s) != sums[s] for s in STOCK_SHEETS):
+                mv = stock_movements(frames["Purchase"], frames["Sales"], frames["Transfers"])
+                self._frame = stock_ledger(mv)
+                self.net = mv.groupby(['Clean', 'Location'], observed=True)['Qty'].sum().to_dict()
+                self.sums.update(sums)
+
+    def apply(self, sheet_name, data_dict):
+        clean = str(data_dict.get("NSP Code", "")).strip().lower()
+        qty = safe_float(data_dict.get("Qty", 0))
+        if sheet_name == "Purchase": legs = [(data_dict.get("Location"), qty)]
+        elif sheet_name == "Sales": legs = [(data_dict.get("Location"), -qty)]
+        elif data_dict.get("From_Loc") in LOCATIONS and data_dict.get("To_Loc") in LOCATIONS:
+            legs = [(data_dict["From_Loc"], -qty), (data_dict["To_Loc"], qty)]
+        else: legs = []
+        with self.lock:
+            if sheet_name not in self.sums: return
+            for loc, q in legs:
+                if loc in LOCATIONS: self.net[(clean, loc)] = self.net.get((clean, loc), 0.0) + q
+            self.bump(sheet_name, 1, qty)
+
+    def stock(self, code, loc):
+        key = (str(code).strip().lower(), loc)
+        with self.lock: return self.opening.get(key, 0.0) + self.net.get(key, 0.0)
+
+    def ledger(self):
+        with self.lock:
+            if self._frame is None:
+                if self.net: self._frame = pd.Series(self.net, dtype=float).unstack().reindex(columns=LOCATIONS).fillna(0.0)
+                else: self._frame = pd.DataFrame(columns=LOCATIONS, dtype=float)
+            return self._frame
+
+@st.cache_resource
+def stock_snapshot(): return StockSnapshot()
+
+# --- RECEIVABLES ---
+AGING_LABELS = ("0-30", "31-60", "61-90", "90+")  # days since the invoice date
+AGING_EDGES = (-math.inf, 30, 60, 90, math.inf)
+RECEIVABLE_COLS = ['Invoice No', 'Date', 'Customer Name', 'Phone', 'Total', 'Paid', 'Balance', 'Lines']
+
+def balance_checksum(df):
+    if df.empty or 'Balance' not in df.columns: return (len(df), 0.0)
+    return (len(df), round(float(to_num(df['Balance']).round(2).sum()), 6))
+
+def customer_key(rec): return (str(rec.get('Customer Name', '')).strip(), str(rec.get('Phone', '')).strip())
+
+class Receivables(SyncedCache):
+    """
+    Open invoices keyed by Invoice No, with each customer's (name, phone) invoices indexed. Paid/Balance are
+    repeated on every line of an invoice, so each invoice is held once with its line count. save_entries and
+    update_balance patch it.
+    """
+    SHEETS = ("Sales",)
+
+    def __init__(self):
+        super().__init__()
+        self.open = {}; self.by_customer = defaultdict(set)
+
+    def sync(self, df):
+        with self.lock:
+            s = balance_checksum(df)
+            if self.sums.get("Sales") == s: return
+            self.open = {}; self.by_customer = defaultdict(set); self._frame = None
+            if {'Invoice No', 'Balance'} <= set(df.columns) and len(df):
+                cols = [c for c in RECEIVABLE_COLS[1:-1] if c in df.columns]
+                g = df[cols].groupby(df['Invoice No'].astype(str), sort=False)
+                first = g.first(); first['Lines'] = g.size()
+                for inv, rec in first[to_num(first['Balance']) > 0].to_dict("index").items(): self.add(inv, rec)
+            self.sums = {"Sales": s}
+
+    def add(self, inv, rec):
+        paid = safe_float(rec.get('Paid', 0)); bal = safe_float(rec.get('Balance', 0)); name, phone = customer_key(rec)
+        self.open[inv] = {'Invoice No': inv, 'Date': str(rec.get('Date', '')), 'Customer Name': name, 'Phone': phone,
+                          'Total': paid + bal, 'Paid': paid, 'Balance': bal, 'Lines': int(rec.get('Lines', 1))}
+        self.by_customer[(name, phone)].add(inv)
+
+    def drop(self, inv):
+        rec = self.open.pop(inv); key = customer_key(rec)
+        self.by_customer[key].discard(inv)
+        if not self.by_customer[key]: del self.by_customer[key]
+
+    def apply(self, lines):
+        """A new sale's invoice lines, as passed to save_entries."""
+        with self.lock:
+            if "Sales" not in self.sums: return
+            self.bump("Sales", len(lines), sum(round(safe_float(l.get('Balance', 0)), 2) for l in lines))
+            by_inv = {}
+            for l in lines: by_inv.setdefault(str(l.get('Invoice No', '')), []).append(l)
+            for inv, ls in by_inv.items():
+                if inv in self.open: self.open[inv]['Lines'] += len(ls)
+                elif safe_float(ls[0].get('Balance', 0)) > 0: self.add(inv, {**ls[0], 'Lines': len(ls)})
+
+    def settle(self, inv_no, amt_paid):
+        """A payment against an invoice, applied to every line of it as SheetsBackend.settle does."""
+        with self.lock:
+            rec = self.open.get(str(inv_no))
+            if "Sales" not in self.sums or rec is None: self.sums = {}; return
+            rec['Paid'] += amt_paid; rec['Balance'] -= amt_paid
+            self.bump("Sales", 0, -round(amt_paid, 2) * rec['Lines'])
+            if rec['Balance'] <= 0.005: self.drop(rec['Invoice No'])
+
+    def get(self, inv_no):
+        with self.lock: return dict(self.open[str(inv_no)]) if str(inv_no) in self.open else None
+
+    def invoices_of(self, key):
+        with self.lock: return sorted(self.by_customer.get(key, ()))
+
+    def pending(self, today=None):
+        """Open invoices with days outstanding and aging bucket, oldest first. Shared: treat as read-only."""
+        today = pd.Timestamp(today or datetime.now().date())
+        with self.lock:
+            if self._frame is None or self._frame[0] != today:
+                df = pd.DataFrame(list(self.open.values()), columns=RECEIVABLE_COLS)
+                days = (today - pd.to_datetime(df['Date'], errors='coerce')).dt.days.fillna(0).clip(lower=0).astype(int)
+                df['Days'] = days; df['Bucket'] = pd.cut(days, AGING_EDGES, labels=AGING_LABELS)
+                self._frame = (today, df.sort_values('Days', ascending=False, kind='stable').reset_index(drop=True))
+            return self._frame[1]
+
+    def customers(self, today=None):
+        """Per-customer outstanding: open invoices, total balance and its split over the aging buckets."""
+        p = self.pending(today)
+        totals = p.groupby(['Customer Name', 'Phone'], sort=False).agg(Invoices=('Invoice No', 'size'), Balance=('Balance', 'sum'))
+        aging = p.pivot_table(index=['Customer Name', 'Phone'], columns='Bucket', values='Balance', aggfunc='sum', fill_value=0.0, observed=False)
+        out = totals.join(aging.reindex(columns=list(AGING_LABELS), fill_value=0.0)).fillna(0.0)
+        return out.sort_values('Balance', ascending=False).reset_index()
+
+@st.cache_resource
+def receivables(): return Receivables()
+
+# --- SALES ROLLUP ---
+ROLLUP_KEYS = ['Date', 'Salesman', 'Mode', 'Bill Type', 'Location']
+# Sales: line totals before tax. An invoice's count and its Paid (collected at the sale and settled since) go under its first line.
+ROLLUP_VALUES = ['Invoices', 'Lines', 'Qty', 'Sales', 'GST', 'Paid']
+
+def rollup_checksum(df):
+    """(rows, sum of Total, sum of Paid over every line): Paid moves on settlements, Total doesn't."""
+    if df.empty: return (0, 0.0, 0.0)
+    col = lambda c: round(float(to_num(df[c]).round(2).sum()), 6) if c in df.columns else 0.0
+    return (len(df), col('Total'), col('Paid'))
+
+def rollup_lines(df):
+    """Per-line rollup keys and values of Sales rows, as a frame."""
+    keys = {k: (df[k].astype(str) if k in df.columns else pd.Series("", index=df.index)) for k in ROLLUP_KEYS}
+    keys['Date'] = keys['Date'].str[:10]
+    # Split payments are stored as "Cash: 500.0 + UPI03: 700.0"; group them by their modes ("Cash + UPI03"), not their amounts.
+    keys['Mode'] = keys['Mode'].str.replace(r"\s*:\s*[-\d.,]+", "", regex=True)
+    num = lambda c: to_num(df[c]).round(2) if c in df.columns else pd.Series(0.0, index=df.index)
+    total = num('Total')
+    first = ~df['Invoice No'].astype(str).duplicated() if 'Invoice No' in df.columns else pd.Series(True, index=df.index)
+    return pd.DataFrame({**keys, 'Invoices': first.astype(int), 'Lines': 1, 'Qty': num('Qty'),
+                         'Sales': total, 'GST': total * GST_RATE * (keys['Bill Type'] == "GST"), 'Paid': num('Paid') * first})
+
+class SalesRollup(SyncedCache):
+    """
+    Daily Sales aggregates by Date x Salesman x Mode x Bill Type x Location, over closed periods and live rows.
+    save_entries adds each sale's lines, delete_entry subtracts a deleted invoice's and update_balance adds
+    payments. Dashboard panels query it instead of grouping Sales history.
+    """
+    SHEETS = ("Sales", "Sales" + ARCHIVE_SUFFIX)
+
+    def __init__(self):
+        super().__init__()
+        self.cells = {}
+
+    def sync(self, archived, live):
+        with self.lock:
+            sums = {"archive": rollup_checksum(archived), "live": rollup_checksum(live)}
+            if self.sums == sums: return
+            self.cells = {}
+            for df in (archived, live):
+                if df.empty: continue
+                g = rollup_lines(df).groupby(ROLLUP_KEYS, sort=False, observed=True)[ROLLUP_VALUES].sum()
+                for key, vals in zip(g.index, g.to_numpy().tolist()): self.add(key, vals, 1)
+            self.sums = sums; self._frame = None
+
+    def add(self, key, vals, sign):
+        cell = self.cells.setdefault(key, [0.0] * len(ROLLUP_VALUES))
+        for i, v in enumerate(vals): cell[i] += sign * v
+        if sign < 0 and cell[1] <= 0: del self.cells[key]
+
+    def apply(self, rows, sign=1):
+        """Sales lines saved (sign=1) or deleted (sign=-1) on the live sheet."""
+        with self.lock:
+            if "live" not in self.sums or not rows: return
+            df = rollup_lines(pd.DataFrame(rows))
+            for rec in df.to_dict("records"): self.add(tuple(rec[k] for k in ROLLUP_KEYS), [rec[v] for v in ROLLUP_VALUES], sign)
+            self.bump("live", sign * len(df), sign * float(df['Sales'].sum()), sign * sum(round(safe_float(r.get('Paid', 0)), 2) for r in rows))
+
+    def settle(self, inv_rows, amt_paid):
+        """A payment against an invoice (its Sales rows as loaded before the payment): collected under its first line."""
+        with self.lock:
+            if "live" not in self.sums or inv_rows.empty: self.sums = {}; return
+            rec = rollup_lines(inv_rows.iloc[:1]).iloc[0]
+            self.add(tuple(rec[k] for k in ROLLUP_KEYS), [amt_paid if v == 'Paid' else 0.0 for v in ROLLUP_VALUES], 1)
+            self.bump("live", 0, 0.0, round(amt_paid, 2) * len(inv_rows))
+
+    def frame(self):
+        """All cells as a frame with Date parsed. Shared: treat as read-only."""
+        with self.lock:
+            if self._frame is None:
+                df = pd.DataFrame([(*k, *v) for k, v in self.cells.items()], columns=ROLLUP_KEYS + ROLLUP_VALUES)
+                df['Date'] = pd.to_datetime(df['Date'], errors='coerce'); df[['Invoices', 'Lines']] = df[['Invoices', 'Lines']].astype(int)
+                self._frame = df.sort_values('Date', kind='stable').reset_index(drop=True)
+            return self._frame
+
+    def between(self, start, end, by=None):
+        """Totals of the days start..end (inclusive), grouped by some of ROLLUP_KEYS (all days together when by is empty)."""
+        df = self.frame()
+        df = df[(df['Date'] >= pd.Timestamp(start)) & (df['Date'] <= pd.Timestamp(end))]
+        if not by: return df[ROLLUP_VALUES].sum()
+        return df.groupby(by, sort=True)[ROLLUP_VALUES].sum().reset_index()
+
+@st.cache_resource
+def sales_rollup(): return SalesRollup()
+
+def sync_rollup():
+    r = sales_rollup(); r.sync(fetch_sheet("Sales" + ARCHIVE_SUFFIX), load_data("Sales"))
+    return r
+
+RECEIPTS_SHEET = "Receipts"  # one row per settlement: the day and mode it was paid in, and the rollup cell its Paid went to
+
+def record_receipt(inv_no, amount, mode, inv_rows, when=None):
+    first = rollup_lines(inv_rows.iloc[:1]).iloc[0]
+    save_entry(RECEIPTS_SHEET, {"Date": (when or datetime.now()).strftime("%Y-%m-%d"), "Invoice No": inv_no, "Amount": amount, "Mode": mode,
+                                "Invoice Date": first['Date'], "Invoice Mode": first['Mode']})
+
+def daily_takings(roll, start, end):
+    """
+    Money taken per day (rows) and Mode (columns), days start..end. The rollup's Paid includes settlements under
+    the invoice's own Date and Mode; each Receipts row moves its amount to the day and mode it was actually paid.
+    """
+    paid = roll.between(start, end, ['Date', 'Mode'])[['Date', 'Mode', 'Paid']]
+    rc = load_data(RECEIPTS_SHEET)
+    if not rc.empty and {'Invoice Date', 'Invoice Mode'} <= set(rc.columns):
+        amt = to_num(rc['Amount'])
+        moves = pd.concat([pd.DataFrame({'Date': rc['Invoice Date'], 'Mode': rc['Invoice Mode'], 'Paid': -amt}),
+                           pd.DataFrame({'Date': rc['Date'], 'Mode': rc['Mode'], 'Paid': amt})], ignore_index=True)
+        moves['Date'] = pd.to_datetime(moves['Date'].astype(str).str[:10], errors='coerce'); moves['Mode'] = moves['Mode'].astype(str)
+        moves = moves[(moves['Date'] >= pd.Timestamp(start)) & (moves['Date'] <= pd.Timestamp(end))]
+        paid = pd.concat([paid.astype({'Mode': str}), moves], ignore_index=True)
+    return paid.pivot_table(index='Date', columns='Mode', values='Paid', aggfunc='sum', fill_value=0.0)
+
+# --- PERIOD CLOSE ---
+CLOSINGS_SHEET = "Period_Closings"
+ARCHIVE_CHUNK = 5000  # rows per archive append, well under the Sheets request size limit
+
+def load_history(sheet_name):
+    """Archived rows of closed periods followed by the live sheet, for screens and reports that reach back past a close."""
+    arch = fetch_sheet(sheet_name + ARCHIVE_SUFFIX); live = load_data(sheet_name)
+    if arch.empty: return live
+    return derive(("history", sheet_name), (arch, live), lambda a, l: concat_typed(sheet_name, a, l) if not l.empty else a)
+
+def plan_period_close(as_of):
+    """
+    What closing the books through as_of would do, without writing anything. Movement rows dated on or
+    before as_of are closed, except Sales rows of invoices with a balance due (kept live so they can still
+    be settled) and rows whose code is not in Products. Each product's opening plus its closed movements
+    becomes its new opening. Reads the sheets fresh from the backend.
+    """
+    require_synced()
+    be = get_backend()
+    raw = {s: be.read(s)[0] for s in ("Products",) + STOCK_SHEETS}
+    typed = {s: apply_schema(s, normalize_cols(df.copy())) for s, df in raw.items()}
+    p = typed["Products"]
+    if p.empty: raise RuntimeError("Products sheet is empty")
+    missing = [c for c in OPENING_BAL_COLS.values() if c not in p.columns]
+    if missing: raise RuntimeError(f"Products sheet has no {', '.join(missing)} column")
+    known = set(clean_code(p['NSP Code'])); cutoff = pd.Timestamp(as_of) + pd.Timedelta(days=1)
+    closed = {}
+    for s in STOCK_SHEETS:
+        df = typed[s]
+        if df.empty or 'Date' not in df.columns or 'NSP Code' not in df.columns: closed[s] = pd.Series(False, index=df.index); continue
+        dates = pd.to_datetime(df['Date'], errors='coerce')
+        mask = dates.notna() & (dates < cutoff) & clean_code(df['NSP Code']).isin(known)
+        if s == "Sales" and 'Balance' in df.columns:
+            mask &= ~df['Invoice No'].isin(df.loc[to_num(df['Balance']) > 0, 'Invoice No'])
+        closed[s] = mask
+    net = stock_ledger(stock_movements(*(typed[s][closed[s]] for s in STOCK_SHEETS))).reindex(clean_code(p['NSP Code'])).fillna(0.0)
+    openings = {col: (to_num(p[col]) + net[loc].to_numpy()).round(6).tolist() for loc, col in OPENING_BAL_COLS.items()}
+    return {"as_of": as_of, "raw": raw, "closed": closed, "openings": openings}
+
+def apply_period_close(plan):
+    """
+    Carry out a plan_period_close() plan: archive the closed rows, write the new openings, then delete the
+    closed rows from the live sheets. Nothing is written if any sheet changed since the plan was made
+    (rows appended at the bottom are fine); in-app settles and deletes wait for the close (row_edit_lock).
+    Archiving comes first, so a failure part-way never loses rows.
+    """
+    require_synced()
+    be = get_backend()
+    with row_edit_lock():  # no settle or delete may shift rows between the check below and the deletes
+        for s, before in plan["raw"].items():
+            now = be.read(s)[0]
+            if len(now) < len(before) or not now.iloc[:len(before)].reset_index(drop=True).equals(before.reset_index(drop=True)):
+                raise RuntimeError(f"{s} changed since the preview, nothing was written. Preview again.")
+        counts = {}
+        for s in STOCK_SHEETS:
+            recs = plan["raw"][s][plan["closed"][s].to_numpy()].to_dict("records")
+            for i in range(0, len(recs), ARCHIVE_CHUNK): be.append(s + ARCHIVE_SUFFIX, recs[i:i + ARCHIVE_CHUNK])
+            counts[s] = len(recs)
+        for col, vals in plan["openings"].items():
+            be.write_column("Products", col, [int(v) if float(v).is_integer() else v for v in vals])
+        for s in STOCK_SHEETS:
+            rows = [i + 2 for i, c in enumerate(plan["closed"][s].to_numpy()) if c]
+            if rows: be.delete_rows_at(s, rows)
+        be.append(CLOSINGS_SHEET, [{"Closed Through": str(plan["as_of"]), "Closed At": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "User": st.session_state.get('user', 'Admin'),
+                                    **{f"{s} Archived": n for s, n in counts.items()}}])
+    invalidate_derived()
+    touch("Products", CLOSINGS_SHEET, *STOCK_SHEETS, *(s + ARCHIVE_SUFFIX for s in STOCK_SHEETS), edited=True)
+    return counts
+
+# --- BULK IMPORT ---
+IMPORT_CHUNK = 5000  # rows read, validated and written per batch; a typical supplier invoice is one chunk
+MARKUP = 3.3  # selling price = cost x 3.3 when only one of the two is given, as on the Purchase form
+IMPORT_KINDS = ("Purchases", "Products")
+
+def import_chunks(file, file_name):
+    """
+    The rows of an uploaded .csv or .xlsx as text DataFrames of up to IMPORT_CHUNK rows, headers normalized,
+    indexed by file row (the header is row 1). Blank rows are counted, then dropped.
+    """
+    if file_name.lower().endswith(".csv"):
+        for chunk in pd.read_csv(file, dtype=str, keep_default_na=False, skip_blank_lines=False, chunksize=IMPORT_CHUNK):
+            chunk = chunk.fillna(""); chunk.index += 2
+            yield normalize_cols(chunk[(chunk != "").any(axis=1)])
+        return
+    wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = [str(h).strip() if h is not None else "" for h in next(rows, ())]
+        buf = []; nums = []
+        for n, r in enumerate(rows, 2):
+            vals = ["" if v is None else v.strftime("%Y-%m-%d") if isinstance(v, datetime) else str(v) for v in r]
+            if not any(vals): continue
+            buf.append((vals + [""] * len(header))[:len(header)]); nums.append(n)
+            if len(buf) == IMPORT_CHUNK: yield normalize_cols(pd.DataFrame(buf, columns=header, index=nums)); buf = []; nums = []
+        if buf: yield normalize_cols(pd.DataFrame(buf, columns=header, index=nums))
+    finally: wb.close()
+
+def bulk_import(chunks, kind, defaults, progress=None):
+    """
+    Import Products or Purchases from import_chunks(). Rows are checked against the catalogue through a
+    dict keyed by clean code. Per chunk, new products go out in one append and changed names/prices in
+    one batched update. Purchases also go out in one append, with one pending Vendor_Payments entry per
+    vendor. defaults fills blank Location / Vendor Name / Date cells. Returns counts plus the rejected
+    rows as (file row, reason).
+    """
+    require_synced()
+    p = load_data("Products"); cat = {}
+    if not p.empty:
+        names = p['Product Name'] if 'Product Name' in p.columns else pd.Series("", index=p.index)
+        cps = to_num(p['Cost Price']) if 'Cost Price' in p.columns else pd.Series(0.0, index=p.index)
+        sps = to_num(p['Selling Price']) if 'Selling Price' in p.columns else pd.Series(0.0, index=p.index)
+        for key, code, name, cp, sp in zip(clean_code(p['NSP Code']), p['NSP Code'], names, cps, sps): cat.setdefault(key, (code, name, cp, sp))
+    out = {"rows": 0, "new_products": 0, "updated_products": 0, "purchases": 0, "payables": 0, "rejected": []}
+    line = 1; stamp = int(time.time())
+    for chunk in chunks:
+        new, changed, purchases, payable = {}, {}, [], defaultdict(float)
+        dates = pd.to_datetime(chunk['Date'], errors='coerce') if 'Date' in chunk.columns else None
+        for i, (line, r) in enumerate(zip(chunk.index.tolist(), chunk.to_dict("records"))):
+            out["rows"] += 1
+            txt = lambda c: str(r.get(c, "")).strip()
+            code = txt("NSP Code"); key = code.lower(); known = cat.get(key)
+            if not code: out["rejected"].append((line, "no NSP Code")); continue
+            name = txt("Product Name") or (known[1] if known else "")
+            if not name: out["rejected"].append((line, f"new code {code} has no Product Name")); continue
+            cp = safe_float(txt("Cost Price")) if txt("Cost Price") else None
+            sp = safe_float(txt("Selling Price")) if txt("Selling Price") else None
+            if known: cp = known[2] if cp is None else cp; sp = known[3] if sp is None else sp
+            else: cp, sp = (cp if cp is not None else (sp or 0.0) / MARKUP), (sp if sp is not None else (cp or 0.0) * MARKUP)
+            if kind == "Purchases":
+                qty = safe_float(txt("Qty"))
+                loc = txt("Location") or defaults.get("location", ""); vendor = txt("Vendor Name") or defaults.get("vendor", "")
+                d = dates.iloc[i] if dates is not None and txt("Date") else None
+                if qty <= 0: out["rejected"].append((line, "Qty must be a positive number")); continue
+                if loc not in LOCATIONS: out["rejected"].append((line, f"unknown Location '{loc}'")); continue
+                if not vendor: out["rejected"].append((line, "no Vendor Name")); continue
+                if d is not None and pd.isna(d): out["rejected"].append((line, f"unreadable Date '{txt('Date')}'")); continue
+                d = d.strftime("%Y-%m-%d") if d is not None else defaults.get("date") or datetime.now().strftime("%Y-%m-%d")
+                purchases.append({"NSP Code": known[0] if known else code, "Product Name": name, "Date": d, "Qty": qty, "Location": loc, "Vendor Name": vendor, "Cost Price": cp, "Selling Price": sp})
+                payable[vendor] += cp * qty
+            if known is None:
+                row = {"NSP Code": code, "Product Name": name, "Cost Price": cp, "Selling Price": sp}
+                row.update({col: safe_float(txt(col)) for col in OPENING_BAL_COLS.values()})
+                new[key] = row; cat[key] = (code, name, cp, sp)
+            elif (name, float(cp), float(sp)) != (known[1], float(known[2]), float(known[3])):
+                if key in new: new[key].update({"Product Name": name, "Cost Price": cp, "Selling Price": sp})
+                else: changed[key] = (known[0], name, cp, sp)
+                cat[key] = (known[0], name, cp, sp)
+        if new and not save_entries("Products", list(new.values())): raise RuntimeError(f"could not add products (rows up to {line})")
+        if changed:
+            require_synced()
+            missing = get_backend().update_products(list(changed.values())); touch("Products", edited=True)
+            if missing: raise RuntimeError(f"products vanished during the import: {', '.join(map(str, missing[:5]))}")
+        if purchases and not save_entries("Purchase", purchases): raise RuntimeError(f"could not save purchases (rows up to {line})")
+        pays = [{"Payment ID": f"PEND-{stamp}-{out['payables'] + k}", "Date": datetime.now().strftime("%Y-%m-%d"), "Vendor Name": v, "Amount": round(a, 2), "Status": "Pending", "Notes": "Bulk import"}
+                for k, (v, a) in enumerate(payable.items())]
+        if pays and not save_entries("Vendor_Payments", pays): raise RuntimeError(f"could not log vendor payables (rows up to {line})")
+        out["new_products"] += len(new); out["updated_products"] += len(changed); out["purchases"] += len(purchases); out["payables"] += len(pays)
+        if progress: progress(out)
+    return out
+
+# --- HISTORY EXPORT ---
+EXPORT_SHEETS = ("Sales", "Receipts", "Purchase", "Vendor_Payments", "Logs")
+EXPORT_CHUNK = 5000  # rows per ranged read; memory stays at about one chunk whatever the sheet size
+EXPORT_DATE_COL = {"Logs": "Timestamp"}  # every other exported sheet is filtered on Date
+
+def stream_sheet(sheet_name, chunk=EXPORT_CHUNK):
+    """
+    Typed chunks of a sheet, read straight from the backend in bounded row ranges (bypassing the sheet cache).
+    Reads run to the row count taken up front: a short or empty chunk only means blank rows at its end.
+    """
+    be = get_backend(); total = be.row_count(sheet_name)
+    for offset in range(0, total, chunk):
+        df = be.read_rows(sheet_name, offset, chunk)
+        if not df.empty: yield apply_schema(sheet_name, normalize_cols(df))
+
+def with_derived(sheet_name, df):
+    """The figures the app computes on screen and on invoices: GST split and line totals for Sales, amounts for Purchase."""
+    if sheet_name == "Sales" and {'Qty', 'Price'} <= set(df.columns):
+        taxable = to_num(df['Qty']) * to_num(df['Price'])
+        gst = taxable * GST_RATE * (df['Bill Type'].astype(str) == "GST") if 'Bill Type' in df.columns else taxable * 0.0
+        return df.assign(**{"Taxable": taxable, "CGST": gst / 2, "SGST": gst / 2, "Line Total": taxable + gst})
+    if sheet_name == "Purchase" and {'Qty', 'Cost Price'} <= set(df.columns):
+        return df.assign(Amount=to_num(df['Qty']) * to_num(df['Cost Price']))
+    return df
+
+def export_frames(sheet_name, start, end):
+    """Chunks of a sheet's rows dated start..end (inclusive), archived periods first, with derived columns."""
+    col = EXPORT_DATE_COL.get(sheet_name, "Date"); lo = pd.Timestamp(start); hi = pd.Timestamp(end) + pd.Timedelta(days=1)
+    for name in ([sheet_name + ARCHIVE_SUFFIX] if sheet_name in STOCK_SHEETS else []) + [sheet_name]:
+        for df in stream_sheet(name):
+            if col in df.columns:
+                d = pd.to_datetime(df[col], errors='coerce'); df = df[(d >= lo) & (d < hi)]
+            if len(df): yield with_derived(sheet_name, df)
+
+def export_history(sheet_names, start, end, fmt, path, progress=None):
+    """
+    Write the sheets' rows for a date range to path chunk by chunk: an .xlsx with one worksheet per sheet
+    (openpyxl write-only mode) or a .zip of one CSV per sheet. Returns the rows written per sheet.
+    """
+    counts = {s: 0 for s in sheet_names}
+    def chunks(s):
+        cols = None
+        for df in export_frames(s, start, end):
+            cols = cols or list(df.columns); df = df.reindex(columns=cols)
+            counts[s] += len(df)
+            if progress: progress(s, counts[s])
+            yield cols, df
+    if fmt == "xlsx":
+        wb = openpyxl.Workbook(write_only=True)
+        for s in sheet_names:
+            ws = wb.create_sheet(s); first = True
+            for cols, df in chunks(s):
+                if first: ws.append(cols); first = False
+                for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None): ws.append(row)
+        wb.save(path)
+    else:
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+            for s in sheet_names:
+                with z.open(f"{s}.csv", "w") as raw, io.TextIOWrapper(raw, encoding="utf-8", newline="") as f:
+                    first = True
+                    for cols, df in chunks(s): df.to_csv(f, header=first, index=False); first = False
+    return counts
+
+# --- PRODUCT SEARCH ---
+PICKER_TOP_K = 20
+
+def trigrams(text):
+    t = f"  {text} "
+    return {t[i:i + 3] for i in range(len(t) - 2)}
+
+class ProductIndex:
+    """
+    Search structure over the catalogue, built once per Products content: code -> row lookup,
+    sorted name/code lists for prefix matches and a trigram posting list for fuzzy matches.
+    Row positions refer to the frame the index was built from.
+    """
+    def __init__(self, codes, names):
+        codes = [str(c) for c in codes]; names = [str(n) for n in names]
+        self.labels = [f"{n} | {c}" for n, c in zip(names, codes)]
+        self.by_code = {}
+        for i, c in enumerate(codes): self.by_code.setdefault(c.strip().lower(), i)
+        self.sorted_keys = sorted([(n.strip().lower(), i) for i, n in enumerate(names)] + [(c.strip().lower(), i) for i, c in enumerate(codes)])
+        self.grams = defaultdict(list)
+        for i, (n, c) in enumerate(zip(names, codes)):
+            for g in trigrams(f"{n} {c}".lower()): self.grams[g].append(i)
+
+    def search(self, query, k=PICKER_TOP_K):
+        """Row positions ranked exact code, then name/code prefix, then trigram similarity; at most k."""
+        q = query.strip().lower()
+        if not q: return []
+        ranked = {}
+        if q in self.by_code: ranked[self.by_code[q]] = 3.0
+        j = bisect.bisect_left(self.sorted_keys, (q, -1))
+        while j < len(self.sorted_keys) and self.sorted_keys[j][0].startswith(q) and len(ranked) < k * 2:
+            ranked.setdefault(self.sorted_keys[j][1], 2.0); j += 1
+        if len(ranked) < k:
+            q_grams = trigrams(q); counts = defaultdict(int)
+            for g in q_grams:
+                for i in self.grams.get(g, ()): counts[i] += 1
+            for i, n in counts.items():
+                score = n / len(q_grams)
+                if score >= 0.4 and i not in ranked: ranked[i] = score
+        return sorted(ranked, key=lambda i: (-ranked[i], self.labels[i]))[:k]
+
+@st.cache_resource
+def product_index_holder(): return {}
+
+def product_index(df):
+    """ProductIndex for an inventory/Products frame, rebuilt only when its codes, names or row order change."""
+    holder = product_index_holder()
+    built = holder.get("built")
+    if built and built[0] is df: return built[2]  # the shared get_inv frame: same object, same index
+    # Per-row hashes compared in order: positions in the index must line up with df's rows.
+    sig = pd.util.hash_pandas_object(df[['NSP Code', 'Product Name']], index=False).reset_index(drop=True)
+    idx = built[2] if built and built[1].equals(sig) else ProductIndex(df['NSP Code'], df['Product Name'])
+    holder["built"] = (df, sig, idx)
+    return idx
+
+def product_picker(df, key, label):
+    """Type-ahead product search. Only the top matches go to the browser; returns the chosen row or None."""
+    idx = product_index(df)
+    q = st.text_input(label, key=f"{key}_q", placeholder="Type a product name or NSP code")
+    if not q: return None
+    hits = idx.search(q)
+    if not hits: st.caption("No matching products."); return None
+    pos = st.selectbox("Matches", hits, format_func=lambda i: idx.labels[i], key=f"{key}_sel")
+    return df.iloc[pos]
 
 # --- HTML GENERATOR ---
-def get_header_html(is_gst):
-    return f"""
+# Layouts are format strings built once at import; the parts that only depend on the document
+# type (header, column heads, filler rows, terms) are cached, so a render only fills in the items.
+INV_TH = "border-right:1px solid #000; border-bottom:1px solid #000; padding:5px; font-weight:bold; background-color:#eee; font-size:12px;"
+INV_TD = "border-right:1px solid #000; padding:5px; vertical-align:middle; font-size:12px;"
+INV_TD_LAST = "padding:5px; vertical-align:middle; font-size:12px;"
+INV_MIN_ROWS = 8
+
+HEADER_TMPL = """
     <div style="text-align:center; border-bottom:2px solid #333; padding-bottom:10px; margin-bottom:20px;">
         <h1 style="margin:0; font-size:28px; color:#b30000; letter-spacing:1px;">SUMEET ENTERPRISES</h1>
         <p style="margin:4px; font-size:12px;">CHETAN SUPER MARKET, TRIMURTI CHOWK, JAWAHAR COLONY ROAD, CH. SAMBHAJINAGAR-431001</p>
         <p style="margin:4px; font-size:12px;"><b>PHONE:</b> 9890834344 | <b>EMAIL:</b> sumeet.enterprises44@gmail.com</p>
-        {f'<p style="margin:4px; font-size:12px;"><b>GSTIN:</b> 27AEGPC7645R1ZV</p>' if is_gst else ''}
+        {gstin}
     </div>
     """
-    
-def render_invoice(data, bill_type="Non-GST"):
-    rows = ""
-    total = 0; gst_tot = 0
-    is_gst = bill_type == "GST"
-    is_quote = str(data.get('inv', '')).startswith('Q')
-    
-    items = data.get('items', [])
-    style_th = "border-right:1px solid #000; border-bottom:1px solid #000; padding:5px; font-weight:bold; background-color:#eee; font-size:12px;"
-    style_td = "border-right:1px solid #000; padding:5px; vertical-align:middle; font-size:12px;"
-    style_td_last = "padding:5px; vertical-align:middle; font-size:12px;" 
-    
-    for i, x in enumerate(items):
-        qty = safe_float(x.get('Qty',0)); rate = safe_float(x.get('Price',0)); disc = safe_float(x.get('Discount',0))
-        amount = qty * rate 
-        if is_gst:
-            taxable = amount; gst_amt = taxable * 0.18; total_line = taxable + gst_amt
-            gst_tot += gst_amt; total += total_line
-            rows += f"""<tr style="border-bottom:1px solid #ccc;"><td style="{style_td} text-align:center;">{i+1}</td><td style="{style_td} text-align:left;">{x['Product Name']}</td><td style="{style_td} text-align:center;">{x['NSP Code']}</td><td style="{style_td} text-align:center;">9403</td><td style="{style_td} text-align:center;">{qty}</td><td style="{style_td} text-align:right;">{rate:,.2f}</td><td style="{style_td} text-align:right;">{disc:,.2f}</td><td style="{style_td} text-align:right;">{amount:,.2f}</td><td style="{style_td} text-align:right;">{gst_amt/2:,.2f}</td><td style="{style_td} text-align:right;">{gst_amt/2:,.2f}</td><td style="{style_td_last} text-align:right; font-weight:bold;">{total_line:,.2f}</td></tr>"""
-        else:
-            total += amount
-            rows += f"""<tr style="border-bottom:1px solid #ccc;"><td style="{style_td} text-align:center;">{i+1}</td><td style="{style_td} text-align:left;">{x['Product Name']}</td><td style="{style_td} text-align:center;">{x['NSP Code']}</td><td style="{style_td} text-align:center;">{qty}</td><td style="{style_td} text-align:right;">{rate:,.2f}</td><td style="{style_td} text-align:right;">{disc:,.2f}</td><td style="{style_td_last} text-align:right; font-weight:bold;">{amount:,.2f}</td></tr>"""
-
-    for k in range(8 - len(items)):
-        cols = 11 if is_gst else 7
-        rows += f"<tr>" + "".join([f"<td style='{style_td} color:white;'>.</td>" for _ in range(cols-1)]) + f"<td style='{style_td_last}'></td></tr>"
-
-    gst_section = ""
-    if is_gst:
-        gst_section = f"""<tr style="border-top:1px solid #000;"><td colspan="8" style="text-align:right; padding:5px; border-right:1px solid #000;"><b>CGST (9%):</b></td><td colspan="3" style="text-align:right; padding:5px;">{gst_tot/2:,.2f}</td></tr><tr><td colspan="8" style="text-align:right; padding:5px; border-right:1px solid #000;"><b>SGST (9%):</b></td><td colspan="3" style="text-align:right; padding:5px;">{gst_tot/2:,.2f}</td></tr>"""
-
-    if is_gst:
-        terms_list = TERMS_AND_CONDITIONS["GST"]; doc_title = "TAX INVOICE"
-    elif is_quote:
-        terms_list = TERMS_AND_CONDITIONS["Quote"]; doc_title = "QUOTATION"
-    else:
-        terms_list = TERMS_AND_CONDITIONS["Estimate"]; doc_title = "ESTIMATE"
 
-    terms_html = "".join([f"<li>{t}</li>" for t in terms_list])
-    bank_html = f"""<div style="margin-top:10px; padding-top:5px; border-top:1px solid #000;"><b>BANK DETAILS:</b> {BANK_DETAILS['Name']} | Acc: {BANK_DETAILS['Account']} | IFSC: {BANK_DETAILS['IFSC']} | Branch: {BANK_DETAILS['Branch']}</div>""" if (is_gst or is_quote) else ""
+INV_ROW = {
+    True: f"""<tr style="border-bottom:1px solid #ccc;"><td style="{INV_TD} text-align:center;">{{sr}}</td><td style="{INV_TD} text-align:left;">{{name}}</td><td style="{INV_TD} text-align:center;">{{code}}</td><td style="{INV_TD} text-align:center;">9403</td><td style="{INV_TD} text-align:center;">{{qty}}</td><td style="{INV_TD} text-align:right;">{{rate:,.2f}}</td><td style="{INV_TD} text-align:right;">{{disc:,.2f}}</td><td style="{INV_TD} text-align:right;">{{amount:,.2f}}</td><td style="{INV_TD} text-align:right;">{{half_gst:,.2f}}</td><td style="{INV_TD} text-align:right;">{{half_gst:,.2f}}</td><td style="{INV_TD_LAST} text-align:right; font-weight:bold;">{{line_total:,.2f}}</td></tr>""",
+    False: f"""<tr style="border-bottom:1px solid #ccc;"><td style="{INV_TD} text-align:center;">{{sr}}</td><td style="{INV_TD} text-align:left;">{{name}}</td><td style="{INV_TD} text-align:center;">{{code}}</td><td style="{INV_TD} text-align:center;">{{qty}}</td><td style="{INV_TD} text-align:right;">{{rate:,.2f}}</td><td style="{INV_TD} text-align:right;">{{disc:,.2f}}</td><td style="{INV_TD_LAST} text-align:right; font-weight:bold;">{{line_total:,.2f}}</td></tr>""",
+}
 
-    cust_gst_display = f"""<div style="margin-top:5px; border:1px solid #000; padding:3px; display:inline-block; font-weight:bold;">GSTIN: {data.get('cust_gst','')}</div>""" if data.get('cust_gst') and is_gst else ""
-    address_display = f"<br><b>Address:</b> {data.get('address','')}" if data.get('address') else ""
-    
-    if is_quote:
-        right_header = f"""<div><b>Date:</b> {data['date']}</div>"""
-        billed_to_header = f"""<b>Name:</b> {data['cust']}<br>Phone: {data['phone']}"""
-    else:
-        right_header = f"""<div style="margin-bottom:12px;"> <b>Invoice No:</b> <span style="font-weight:bold; font-size:14px;">{data['inv']}</span></div><div><b>Date:</b> {data['date']}</div><div style="margin-top:5px;"><b>Mode:</b> {data.get('mode','')}</div>"""
-        billed_to_header = f"""<b style="text-decoration:underline;">Customer Details:</b><br><b>Name: {data['cust']}</b><br>Phone: {data['phone']}{address_display}{cust_gst_display}"""
+INV_GST_TOTALS = """<tr style="border-top:1px solid #000;"><td colspan="8" style="text-align:right; padding:5px; border-right:1px solid #000;"><b>CGST (9%):</b></td><td colspan="3" style="text-align:right; padding:5px;">{half:,.2f}</td></tr><tr><td colspan="8" style="text-align:right; padding:5px; border-right:1px solid #000;"><b>SGST (9%):</b></td><td colspan="3" style="text-align:right; padding:5px;">{half:,.2f}</td></tr>"""
 
-    amt_words = num_to_words(int(total)) + " Only"
-    gst_headers = f'<th style="{style_th}">Taxable</th><th style="{style_th}">CGST</th><th style="{style_th}">SGST</th>' if is_gst else ''
-    hsn_header = f'<th style="{style_th}">HSN</th>' if is_gst else ''
-    last_col_header = f'<th style="padding:5px; font-weight:bold; background-color:#eee; font-size:12px; border-bottom:1px solid #000;">Total</th>'
+INV_PARTY = {
+    "quote": ("""<b>Name:</b> {cust}<br>Phone: {phone}""", """<div><b>Date:</b> {date}</div>"""),
+    "invoice": ("""<b style="text-decoration:underline;">Customer Details:</b><br><b>Name: {cust}</b><br>Phone: {phone}{address}{cust_gst}""",
+                """<div style="margin-bottom:12px;"> <b>Invoice No:</b> <span style="font-weight:bold; font-size:14px;">{inv}</span></div><div><b>Date:</b> {date}</div><div style="margin-top:5px;"><b>Mode:</b> {mode}</div>"""),
+}
 
-    html = f"""
+INVOICE_PAGE = """
     <html>
     <head>
-        <title>Invoice {data['inv']}</title>
+        <title>Invoice {inv}</title>
         <style>
             @page {{ size: A4; margin: 0; }}
             body {{ font-family: Arial, sans-serif; margin: 0; padding: 0; }}
@@ -420,26 +2006,26 @@ def render_invoice(data, bill_type="Non-GST"):
         </div>
 
         <div style="width:210mm; min-height:297mm; margin:auto; font-family:Arial, sans-serif; border:1px solid #000; background:white; color:black; box-sizing: border-box;">
-            {get_header_html(is_gst)}
+            {header}
             <div style="text-align:center; padding:5px; background-color:#eee; border-bottom:1px solid #000; font-weight:bold; letter-spacing:1px;">{doc_title}</div>
             <div style="display:flex; border-bottom:1px solid #000;">
-                <div style="width:60%; padding:10px; border-right:1px solid #000; font-size:13px; line-height:1.4;">{billed_to_header}</div>
+                <div style="width:60%; padding:10px; border-right:1px solid #000; font-size:13px; line-height:1.4;">{billed_to}</div>
                 <div style="width:40%; padding:10px; font-size:13px;">{right_header}</div>
             </div>
             <table style="width:100%; border-collapse:collapse; text-align:center; font-size:12px;">
-                <thead><tr><th style="{style_th} width:5%;">Sr.</th><th style="{style_th} width:35%;">Description</th><th style="{style_th}">Code</th>{hsn_header}<th style="{style_th}">Qty</th><th style="{style_th}">Rate</th><th style="{style_th}">Disc</th>{gst_headers}{last_col_header}</tr></thead>
+                <thead>{thead}</thead>
                 <tbody>{rows}</tbody>
-                <tfoot>{gst_section}<tr style="background-color:#eee; border-top:1px solid #000; border-bottom:1px solid #000;"><td colspan="{10 if is_gst else 6}" style="text-align:right; padding:8px; font-size:14px; border-right:1px solid #000;"><b>GRAND TOTAL:</b></td><td style="padding:8px; font-size:15px; font-weight:bold;">₹ {total:,.2f}</td></tr></tfoot>
+                <tfoot>{gst_section}<tr style="background-color:#eee; border-top:1px solid #000; border-bottom:1px solid #000;"><td colspan="{total_span}" style="text-align:right; padding:8px; font-size:14px; border-right:1px solid #000;"><b>GRAND TOTAL:</b></td><td style="padding:8px; font-size:15px; font-weight:bold;">₹ {total:,.2f}</td></tr></tfoot>
             </table>
             <div style="padding:10px; border-bottom:1px solid #000; font-size:13px;"><b>Amount in Words:</b> {amt_words}</div>
             <div style="display:flex; border-bottom:1px solid #000; text-align:center; font-size:13px;">
                 <div style="width:33%; padding:8px; border-right:1px solid #000;">Grand Total<br><b>₹ {total:,.2f}</b></div>
-                <div style="width:33%; padding:8px; border-right:1px solid #000;">Paid Amount<br><b style="color:green;">₹ {safe_float(data.get('paid',0)):,.2f}</b></div>
-                <div style="width:33%; padding:8px;">Balance Due<br><b style="color:red;">₹ {safe_float(data.get('bal',0)):,.2f}</b></div>
+                <div style="width:33%; padding:8px; border-right:1px solid #000;">Paid Amount<br><b style="color:green;">₹ {paid:,.2f}</b></div>
+                <div style="width:33%; padding:8px;">Balance Due<br><b style="color:red;">₹ {bal:,.2f}</b></div>
             </div>
             <div style="display:flex; font-size:11px;">
                 <div style="width:65%; padding:10px; border-right:1px solid #000;">
-                    <b>TERMS & CONDITIONS:</b><ol style="margin:5px 0 0 15px; padding:0;">{terms_html}</ol>{bank_html}
+                    <b>TERMS & CONDITIONS:</b><ol style="margin:5px 0 0 15px; padding:0;">{terms}</ol>{bank}
                 </div>
                 <div style="width:35%; padding:10px; text-align:center; display:flex; flex-direction:column; justify-content:space-between;">
                     <b>For SUMEET ENTERPRISES</b><br><br><br><div style="border-top:1px dashed #000; width:80%; margin:0 auto;">Authorised Signatory</div>
@@ -450,22 +2036,21 @@ def render_invoice(data, bill_type="Non-GST"):
     </body>
     </html>
     """
-    components.html(html, height=1150, scrolling=True)
-def render_receipt(data):
-    html = f"""
+
+RECEIPT_PAGE = """
     <div style="width:210mm; padding:30px; margin:auto; font-family:Helvetica, Arial, sans-serif; border:1px solid #ddd; background:white; color:black;">
-        {get_header_html(False)}
+        {header}
         <h2 style="text-align:center; border:2px solid #000; width:300px; margin:20px auto; padding:5px;">PAYMENT RECEIPT</h2>
         <div style="border:1px solid #000; padding:20px; font-size:14px; line-height:2;">
             <table style="width:100%;">
-                <tr><td><b>Receipt Date:</b></td><td>{data['date']}</td><td><b>Against Invoice:</b></td><td>{data['inv']}</td></tr>
-                <tr><td><b>Received From:</b></td><td colspan="3" style="border-bottom:1px dotted #000;">{data['cust']}</td></tr>
-                <tr><td><b>Payment Mode:</b></td><td>{data['mode']}</td><td><b>Amount Received:</b></td><td style="font-size:18px; font-weight:bold;">₹ {data['amt']:,.2f}</td></tr>
+                <tr><td><b>Receipt Date:</b></td><td>{date}</td><td><b>Against Invoice:</b></td><td>{inv}</td></tr>
+                <tr><td><b>Received From:</b></td><td colspan="3" style="border-bottom:1px dotted #000;">{cust}</td></tr>
+                <tr><td><b>Payment Mode:</b></td><td>{mode}</td><td><b>Amount Received:</b></td><td style="font-size:18px; font-weight:bold;">₹ {amt:,.2f}</td></tr>
             </table>
             <br>
             <div style="border:1px dashed #000; padding:15px; background-color:#f9f9f9; text-align:center;">
                 <p style="margin:0;"><b>Remaining Balance Amount:</b></p>
-                <h1 style="margin:5px 0; color:red;">₹ {data['bal']:,.2f}</h1>
+                <h1 style="margin:5px 0; color:red;">₹ {bal:,.2f}</h1>
             </div>
         </div>
         <div style="margin-top:50px; text-align:right;">
@@ -474,17 +2059,125 @@ def render_receipt(data):
         <div style="text-align:center; margin-top:20px; font-style:italic; font-size:12px;">*** Thank You - Visit Again ***</div>
     </div>
     """
-    components.html(html, height=800, scrolling=True)
+
+@functools.lru_cache(maxsize=None)
+def get_header_html(is_gst):
+    return HEADER_TMPL.format(gstin='<p style="margin:4px; font-size:12px;"><b>GSTIN:</b> 27AEGPC7645R1ZV</p>' if is_gst else '')
+
+@functools.lru_cache(maxsize=None)
+def invoice_layout(is_gst, is_quote):
+    """The parts of an invoice that depend only on its type."""
+    terms_key, doc_title = ("GST", "TAX INVOICE") if is_gst else ("Quote", "QUOTATION") if is_quote else ("Estimate", "ESTIMATE")
+    hsn_header = f'<th style="{INV_TH}">HSN</th>' if is_gst else ''
+    gst_headers = f'<th style="{INV_TH}">Taxable</th><th style="{INV_TH}">CGST</th><th style="{INV_TH}">SGST</th>' if is_gst else ''
+    thead = f'<tr><th style="{INV_TH} width:5%;">Sr.</th><th style="{INV_TH} width:35%;">Description</th><th style="{INV_TH}">Code</th>{hsn_header}<th style="{INV_TH}">Qty</th><th style="{INV_TH}">Rate</th><th style="{INV_TH}">Disc</th>{gst_headers}<th style="padding:5px; font-weight:bold; background-color:#eee; font-size:12px; border-bottom:1px solid #000;">Total</th></tr>'
+    cols = 11 if is_gst else 7
+    filler = "<tr>" + "".join([f"<td style='{INV_TD} color:white;'>.</td>" for _ in range(cols - 1)]) + f"<td style='{INV_TD_LAST}'></td></tr>"
+    bank = f"""<div style="margin-top:10px; padding-top:5px; border-top:1px solid #000;"><b>BANK DETAILS:</b> {BANK_DETAILS['Name']} | Acc: {BANK_DETAILS['Account']} | IFSC: {BANK_DETAILS['IFSC']} | Branch: {BANK_DETAILS['Branch']}</div>""" if (is_gst or is_quote) else ""
+    return {"header": get_header_html(is_gst), "doc_title": doc_title, "thead": thead, "filler": filler, "total_span": cols - 1,
+            "terms": "".join([f"<li>{t}</li>" for t in TERMS_AND_CONDITIONS[terms_key]]), "bank": bank}
+
+def invoice_html(data, bill_type="Non-GST"):
+    """Full invoice / quotation page for a print_data dict. Pure function: safe to run in a worker process."""
+    is_gst = bill_type == "GST"
+    is_quote = str(data.get('inv', '')).startswith('Q')
+    layout = invoice_layout(is_gst, is_quote)
+    row_tmpl = INV_ROW[is_gst]
+    items = data.get('items', [])
+    rows = []; total = 0; gst_tot = 0
+    for i, x in enumerate(items):
+        qty = safe_float(x.get('Qty',0)); rate = safe_float(x.get('Price',0)); disc = safe_float(x.get('Discount',0))
+        amount = qty * rate
+        gst_amt = amount * GST_RATE if is_gst else 0
+        line_total = amount + gst_amt; gst_tot += gst_amt; total += line_total
+        rows.append(row_tmpl.format(sr=i + 1, name=x['Product Name'], code=x['NSP Code'], qty=qty, rate=rate, disc=disc, amount=amount, half_gst=gst_amt / 2, line_total=line_total))
+    rows.append(layout["filler"] * max(0, INV_MIN_ROWS - len(items)))
+    billed_to, right_header = INV_PARTY["quote" if is_quote else "invoice"]
+    party = {"cust": data['cust'], "phone": data['phone'], "date": data['date'], "inv": data['inv'], "mode": data.get('mode',''),
+             "address": f"<br><b>Address:</b> {data.get('address','')}" if data.get('address') else "",
+             "cust_gst": f"""<div style="margin-top:5px; border:1px solid #000; padding:3px; display:inline-block; font-weight:bold;">GSTIN: {data.get('cust_gst','')}</div>""" if data.get('cust_gst') and is_gst else ""}
+    return INVOICE_PAGE.format(**layout, inv=data['inv'], billed_to=billed_to.format(**party), right_header=right_header.format(**party),
+                               rows="".join(rows), gst_section=INV_GST_TOTALS.format(half=gst_tot / 2) if is_gst else "", total=total,
+                               amt_words=num_to_words(int(total)) + " Only", paid=safe_float(data.get('paid',0)), bal=safe_float(data.get('bal',0)))
+
+@functools.lru_cache(maxsize=32)
+def cached_invoice_html(payload, bill_type):
+    return invoice_html(json.loads(payload), bill_type)
+
+@instrumented("render_invoice")
+def render_invoice(data, bill_type="Non-GST"):
+    # The preview stays open across reruns: render each distinct invoice once.
+    html = cached_invoice_html(json.dumps(data, sort_keys=True, default=str), bill_type)
+    components.html(html, height=1150, scrolling=True)
+
+def receipt_html(data):
+    return RECEIPT_PAGE.format(header=get_header_html(False), date=data['date'], inv=data['inv'], cust=data['cust'], mode=data['mode'], amt=data['amt'], bal=data['bal'])
+
+@instrumented("render_receipt")
+def render_receipt(data):
+    components.html(receipt_html(data), height=800, scrolling=True)
+
+# --- BATCH INVOICE EXPORT ---
+EXPORT_MIN_PARALLEL = 8  # PDF batches at least this big go to a process pool; HTML (well under 1 ms each) always renders in-process
+
+def pdf_supported(): return importlib.util.find_spec("weasyprint") is not None
+
+def invoice_data(inv_no, inv_rows):
+    """print_data dict for one invoice from its Sales rows (as the reprint builds it)."""
+    first = inv_rows.iloc[0]
+    return {"inv": inv_no, "cust": first['Customer Name'], "phone": first['Phone'], "date": first['Date'], "items": line_items(inv_rows), "mode": first.get('Mode',''), "bill_type": first.get('Bill Type', 'Non-GST'), "cust_gst": first.get('Customer GST', ''), "address": first.get('Address', ''), "salesman": first.get('Salesman', ''), "paid": safe_float(first.get('Paid', 0)), "bal": safe_float(first.get('Balance', 0))}
+
+def invoices_between(df_sales, start, end):
+    """invoice_data for every invoice dated start..end (inclusive), in sheet order."""
+    if df_sales.empty: return []
+    dates = pd.to_datetime(df_sales['Date'], errors='coerce').dt.date
+    sel = df_sales[(dates >= start) & (dates <= end)]
+    return [invoice_data(inv, g) for inv, g in sel.groupby('Invoice No', sort=False)]
+
+def export_invoices(docs, out_dir, fmt="html", workers=None):
+    """
+    Render invoices to files in out_dir and return the paths. The HTML is built here; PDF conversion of a
+    big batch runs in spawned processes from invoice_export, which never import this script.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(invoice_html(d, d.get('bill_type', 'Non-GST')), os.path.join(out_dir, re.sub(r"[^\w.-]", "_", str(d['inv'])) + "." + fmt)) for d in docs]
+    if fmt == "pdf" and len(jobs) >= EXPORT_MIN_PARALLEL:
+        return invoice_export.write_pdfs(jobs, workers or min(len(jobs) // EXPORT_MIN_PARALLEL + 1, os.cpu_count() or 1))
+    if fmt == "pdf": return [invoice_export.write_pdf(html, path) for html, path in jobs]
+    for html, path in jobs:
+        with open(path, "w", encoding="utf-8") as f: f.write(html)
+    return [path for _, path in jobs]
+
+def zip_files(paths):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
+        for p in paths: z.write(p, os.path.basename(p))
+    return buf.getvalue()
+
+class DefinitionsOnly(Exception):
+    """Stops the script where the page starts when it is loaded for its definitions (bench/run.py, the tests)."""
 
 # --- MAIN APP START ---
+if __name__ != "__main__": raise DefinitionsOnly  # streamlit runs the script as __main__; loaders use another name
+metrics().begin_run()
 if not check_login(): st.stop()
 
 with st.sidebar:
     st.title("⚡ NEW SUMEET ENTERPRISES")
-    menu = st.radio("Navigation", ["Dashboard", "Sales", "Settle Balance", "Purchase", "Stock Transfer", "Inventory", "Quotations", "Manufacturing", "Vendor Payments", "Products", "Logs"])
+    menu = st.radio("Navigation", ["Dashboard", "Sales", "Settle Balance", "Purchase", "Stock Transfer", "Inventory", "Quotations", "Manufacturing", "Vendor Payments", "Products", "Logs"] + (["Diagnostics"] if st.session_state.get('user') == "owner" else []))
+    metrics().set_page(menu)
     st.divider()
-    if st.button("🔄 Refresh Data"): clear_cache(); st.rerun()
+    if st.button("🔄 Refresh Data"): invalidate_derived(); clear_cache(); st.rerun()
     if st.button("🔒 Logout"): st.session_state.authenticated = False; st.rerun()
+    ob = get_outbox()
+    if ob and ob.pending:
+        st.caption(f"⏳ {len(ob.pending)} save(s) syncing to the sheet" + (f" (retrying {', '.join(f'{s}: {e}' for s, e in ob.errors.items())})" if ob.errors else ""))
+    if ob and ob.dead:
+        with st.expander(f"⚠️ {len(ob.dead)} save(s) rejected by the sheet"):
+            for d in ob.dead: st.caption(f"{d['at']} · {d['sheet']} · {len(d['rows'])} row(s) · {d['error']}")
+            c1, c2 = st.columns(2)
+            if c1.button("Retry"): ob.requeue(); st.rerun()
+            if c2.button("Discard"): ob.discard_dead(); st.rerun()
 
 if 'cart' not in st.session_state: st.session_state.cart = []
 if 'inv_counter' not in st.session_state: st.session_state.inv_counter = int(time.time())
@@ -509,6 +2202,46 @@ if menu == "Dashboard":
         st.markdown("### ⚠️ Low Stock Alert (Shop < 3)")
         low = df[df['Shop'] < 3][['NSP Code','Product Name','Shop','Big Godown']]
         render_filtered_table(low, "dash")
+    st.divider()
+    st.markdown("### 🧾 Sales")
+    roll = sync_rollup()
+    c1, c2 = st.columns(2)
+    s_from = c1.date_input("From", datetime.now().replace(day=1), key="dash_from"); s_to = c2.date_input("To", key="dash_to")
+    tot = roll.between(s_from, s_to); takings = daily_takings(roll, s_from, s_to)
+    m1, m2, m3, m4, m5 = st.columns(5)
+    m1.metric("💵 Sales (incl. GST)", f"₹{tot['Sales'] + tot['GST']:,.0f}")
+    m2.metric("💰 Collected", f"₹{takings.to_numpy().sum():,.0f}")
+    m3.metric("🏛️ GST", f"₹{tot['GST']:,.0f}")
+    m4.metric("🧾 Invoices", int(tot['Invoices']))
+    m5.metric("📦 Units Sold", int(tot['Qty']))
+    t1, t2, t3, t4 = st.tabs(["📅 Daily Takings by Mode", "🧑‍💼 Salesman", "🧾 GST vs Estimate", "📍 Location"])
+    with t1:
+        if not takings.empty:
+            st.bar_chart(takings)
+            st.dataframe(takings.assign(Total=takings.sum(axis=1)), use_container_width=True)
+    for tab, col in ((t2, 'Salesman'), (t3, 'Bill Type'), (t4, 'Location')):
+        with tab: st.dataframe(roll.between(s_from, s_to, [col]).sort_values('Sales', ascending=False), use_container_width=True, hide_index=True)
+    with st.expander("📤 Export History (for the accountant)"):
+        with st.form("export_history"):
+            c1, c2, c3 = st.columns(3)
+            ex_from = c1.date_input("From", datetime(datetime.now().year - (datetime.now().month < 4), 4, 1))  # start of the financial year
+            ex_to = c2.date_input("To"); ex_fmt = c3.radio("Format", ["xlsx", "csv"], horizontal=True)
+            ex_sheets = st.multiselect("Sheets", EXPORT_SHEETS, default=["Sales", "Purchase"])
+            if st.form_submit_button("Export") and ex_sheets:
+                if st.session_state.get("export_dir"): st.session_state.export_dir.cleanup()
+                st.session_state.export_file = None
+                # Owned by the session: replaced (and deleted) by the next export, deleted with the session otherwise.
+                st.session_state.export_dir = tempfile.TemporaryDirectory(prefix="export_")
+                path = os.path.join(st.session_state.export_dir.name, f"nexus_{ex_from}_{ex_to}.{'xlsx' if ex_fmt == 'xlsx' else 'zip'}")
+                status = st.empty()
+                try:
+                    counts = export_history(ex_sheets, ex_from, ex_to, ex_fmt, path, progress=lambda s, n: status.info(f"{s}: {n} rows..."))
+                    status.success("Exported " + ", ".join(f"{s} {n}" for s, n in counts.items()) + " rows.")
+                    st.session_state.export_file = path
+                except Exception as e: status.error(f"Export Error: {e}")
+        if st.session_state.get("export_file") and os.path.exists(st.session_state.export_file):
+            with open(st.session_state.export_file, "rb") as f:
+                st.download_button("⬇️ Download Export", f, file_name=os.path.basename(st.session_state.export_file))
 
 # --- INVENTORY ---
 elif menu == "Inventory":
@@ -517,6 +2250,22 @@ elif menu == "Inventory":
     show_cols = ['NSP Code', 'Product Name', 'Total Stock', 'Shop', 'Terrace Godown', 'Big Godown', 'Selling Price', 'Cost Price']
     final_cols = [c for c in show_cols if c in df.columns]
     render_filtered_table(df[final_cols], "inv")
+    if st.session_state.get('user') == "owner":
+        with st.expander("🗓️ Close Period (roll opening stock forward)"):
+            st.caption("Closing stock as of the date becomes the new opening stock; older Purchase/Sales/Transfers rows move to archive sheets. Invoices with a balance due stay live.")
+            as_of = st.date_input("Close books through", key="close_as_of")
+            if st.button("Preview Close"):
+                try: st.session_state.close_plan = plan_period_close(as_of)
+                except Exception as e: st.error(f"Close Error: {e}")
+            plan = st.session_state.get("close_plan")
+            if plan and plan["as_of"] == as_of:
+                for s in STOCK_SHEETS: st.write(f"**{s}:** {int(plan['closed'][s].sum())} of {len(plan['raw'][s])} rows will be archived")
+                if st.button("✅ Confirm Close", type="primary"):
+                    try:
+                        counts = apply_period_close(plan); del st.session_state.close_plan
+                        log_action("Period Close", f"through {as_of}: " + ", ".join(f"{s} {n}" for s, n in counts.items()))
+                        st.success("Period closed!"); st.rerun()
+                    except Exception as e: st.error(f"Close Error: {e}")
 
 # --- SALES ---
 elif menu == "Sales":
@@ -538,11 +2287,9 @@ elif menu == "Sales":
             
             df = get_inv()
             if not df.empty:
-                df['Search'] = df['Product Name'] + " | " + df['NSP Code']
-                sel = st.selectbox("Search Product", df['Search'].unique(), index=None)
-                if sel:
-                    it = df[df['Search'] == sel].iloc[0]
-                    av = it[loc_s]
+                it = product_picker(df, "sale_pick", "Search Product")
+                if it is not None:
+                    av = stock_snapshot().stock(it['NSP Code'], loc_s)
                     mrp = safe_float(it['Selling Price'])
                     st.info(f"Available: {av} | MRP: ₹{mrp}")
                     c1, c2, c3 = st.columns(3)
@@ -613,43 +2360,57 @@ elif menu == "Sales":
                     bal = final_bill_amount - final_paid
                     final_inv = inv_input
                     
-                    for x in st.session_state.cart:
-                        save_entry("Sales", {
-                            "Invoice No":final_inv, "Date":d, "Customer Name":cust, "Phone":ph,
-                            "NSP Code":x['NSP Code'], "Product Name":x['Product Name'],
-                            "Qty":x['Qty'], "Price":x['Price'], "Discount":x['Discount'],
-                            "Total":x['Total'], "Paid":final_paid, "Balance":bal, 
-                            "Mode":mode_val, "Bill Type":b_type, "Location":x['Location'], 
-                            "Salesman": salesman, "Customer GST": cust_gst, "Address": cust_addr
-                        })
+                    lines = [{
+                        "Invoice No":final_inv, "Date":d, "Customer Name":cust, "Phone":ph,
+                        "NSP Code":x['NSP Code'], "Product Name":x['Product Name'],
+                        "Qty":x['Qty'], "Price":x['Price'], "Discount":x['Discount'],
+                        "Total":x['Total'], "Paid":final_paid, "Balance":bal, 
+                        "Mode":mode_val, "Bill Type":b_type, "Location":x['Location'], 
+                        "Salesman": salesman, "Customer GST": cust_gst, "Address": cust_addr
+                    } for x in st.session_state.cart]
                     
-                    st.session_state.print_data = {
-                        "inv":final_inv, "cust":cust, "phone":ph, "date":d, "items":st.session_state.cart,
-                        "total":final_bill_amount, "paid":final_paid, "bal":bal, "mode":mode_val, 
-                        "loc_source":loc_s, "bill_type":b_type, "cust_gst": cust_gst, 
-                        "address": cust_addr, "salesman": salesman
-                    }
-                    st.session_state.cart = []
-                    log_action("Sale", final_inv)
-                    st.rerun()
+                    if save_entries("Sales", lines):
+                        st.session_state.print_data = {
+                            "inv":final_inv, "cust":cust, "phone":ph, "date":d, "items":st.session_state.cart,
+                            "total":final_bill_amount, "paid":final_paid, "bal":bal, "mode":mode_val, 
+                            "loc_source":loc_s, "bill_type":b_type, "cust_gst": cust_gst, 
+                            "address": cust_addr, "salesman": salesman
+                        }
+                        st.session_state.cart = []
+                        log_action("Sale", final_inv)
+                        st.rerun()
     with t2:
-        df_hist = load_data("Sales")
-        render_filtered_table(df_hist, "sales_hist")
+        with_archive = st.checkbox("Include closed periods")
+        df_hist = load_history("Sales") if with_archive else load_data("Sales")
+        render_filtered_table(df_hist, "sales_hist", (sheet_version("Sales"), sheet_version("Sales" + ARCHIVE_SUFFIX) if with_archive else None, len(df_hist)))
         if not df_hist.empty:
             st.divider()
             sel_inv = st.selectbox("Select Invoice to Reprint/Delete", df_hist['Invoice No'].unique())
             c1, c2 = st.columns(2)
             if c1.button("Reprint Invoice"):
-                inv_data = df_hist[df_hist['Invoice No'] == sel_inv]
+                inv_data = rows_for(df_hist, "Sales", sel_inv)
                 if not inv_data.empty:
-                    first = inv_data.iloc[0]
-                    items = [{"Product Name": r['Product Name'], "NSP Code": r['NSP Code'],"Qty": r['Qty'], "Price": r['Price'], "Discount": r.get('Discount', 0)} for i, r in inv_data.iterrows()]
-                    st.session_state.print_data = {"inv": sel_inv, "cust": first['Customer Name'], "phone": first['Phone'], "date": first['Date'], "items": items, "mode": first.get('Mode',''), "bill_type": first.get('Bill Type', 'Non-GST'), "cust_gst": first.get('Customer GST', ''), "address": first.get('Address', ''), "salesman": first.get('Salesman', ''), "paid": safe_float(first.get('Paid', 0)), "bal": safe_float(first.get('Balance', 0))}
+                    st.session_state.print_data = invoice_data(sel_inv, inv_data)
                     st.rerun()
             if c2.button("❌ Delete Invoice"):
                 if delete_entry("Sales", "Invoice No", sel_inv):
                     log_action("Delete Sale", sel_inv)
                     st.success("Deleted!"); st.rerun()
+            with st.expander("📦 Batch Export (month-end / statements)"):
+                with st.form("batch_export"):
+                    e1, e2, e3 = st.columns(3)
+                    d_from = e1.date_input("From", datetime.now().replace(day=1)); d_to = e2.date_input("To")
+                    fmt = e3.radio("Format", ["html", "pdf"] if pdf_supported() else ["html"], horizontal=True)
+                    if st.form_submit_button("Export Invoices"):
+                        docs = invoices_between(df_hist, d_from, d_to)
+                        if not docs: st.warning("No invoices in that range.")
+                        else:
+                            with st.spinner(f"Rendering {len(docs)} invoices..."):
+                                with tempfile.TemporaryDirectory(prefix="invoices_") as out_dir:
+                                    st.session_state.export_zip = (f"invoices_{d_from}_{d_to}.zip", zip_files(export_invoices(docs, out_dir, fmt)))
+                            log_action("Export Invoices", f"{len(docs)} ({d_from} to {d_to})")
+                if 'export_zip' in st.session_state:
+                    st.download_button("⬇️ Download ZIP", st.session_state.export_zip[1], file_name=st.session_state.export_zip[0], mime="application/zip")
 
 # --- SETTLE BALANCE ---
 elif menu == "Settle Balance":
@@ -661,37 +2422,40 @@ elif menu == "Settle Balance":
             del st.session_state.receipt_data
             st.rerun()
     else:
-        df_s = load_data("Sales")
-        if not df_s.empty:
-            df_s['Balance'] = df_s['Balance'].apply(safe_float)
-            pending = df_s[df_s['Balance'] > 0].drop_duplicates(subset=['Invoice No'])
-            if pending.empty:
-                st.success("🎉 No Pending Payments!")
-            else:
-                st.markdown("### 📋 Pending Invoices")
-                st.dataframe(pending[['Invoice No', 'Date', 'Customer Name', 'Phone', 'Total', 'Paid', 'Balance']], use_container_width=True)
-                st.divider()
-                sel_inv_pay = st.selectbox("Select Invoice to Settle", pending['Invoice No'].unique())
-                if sel_inv_pay:
-                    row = pending[pending['Invoice No'] == sel_inv_pay].iloc[0]
-                    curr_bal = row['Balance']
-                    cust_name = row['Customer Name']
-                    st.info(f"Customer: {cust_name} | Current Balance: ₹{curr_bal}")
-                    with st.form("settle_form"):
-                        pay_amt = st.number_input("Enter Amount to Pay", 1.0, max_value=float(curr_bal))
-                        pay_mode = st.selectbox("Payment Mode", PAYMENT_MODES)
-                        note = st.text_input("Note (Optional)")
-                        if st.form_submit_button("Confirm Payment"):
-                            if update_balance(sel_inv_pay, pay_amt):
-                                log_action("Settlement", f"{sel_inv_pay} - {pay_amt}")
-                                st.session_state.receipt_data = {"date": datetime.now().strftime("%Y-%m-%d"), "inv": sel_inv_pay, "cust": cust_name, "amt": pay_amt, "mode": pay_mode, "bal": curr_bal - pay_amt}
-                                st.rerun()
-                            else: st.error("Error updating database.")
+        rcv = receivables(); rcv.sync(load_data("Sales"))
+        pending = rcv.pending()
+        if pending.empty:
+            st.success("🎉 No Pending Payments!")
+        else:
+            aged = pending.groupby('Bucket', observed=False)['Balance'].sum()
+            for col, label in zip(st.columns(len(AGING_LABELS)), AGING_LABELS): col.metric(f"⏳ {label} days", f"₹{aged.get(label, 0.0):,.0f}")
+            custs = rcv.customers()
+            t1, t2 = st.tabs(["📋 Pending Invoices", "👥 By Customer"])
+            with t1: st.dataframe(pending[['Invoice No', 'Date', 'Customer Name', 'Phone', 'Total', 'Paid', 'Balance', 'Days', 'Bucket']], use_container_width=True)
+            with t2: st.dataframe(custs, use_container_width=True)
+            st.divider()
+            who = st.selectbox("Customer", [None] + list(zip(custs['Customer Name'], custs['Phone'])), format_func=lambda k: "All customers" if k is None else f"{k[0]} ({k[1]})" if k[1] else k[0])
+            sel_inv_pay = st.selectbox("Select Invoice to Settle", rcv.invoices_of(who) if who else pending['Invoice No'])
+            rec = rcv.get(sel_inv_pay) if sel_inv_pay else None
+            if rec:
+                curr_bal = rec['Balance']
+                cust_name = rec['Customer Name']
+                st.info(f"Customer: {cust_name} | Current Balance: ₹{curr_bal}")
+                with st.form("settle_form"):
+                    pay_amt = st.number_input("Enter Amount to Pay", 1.0, max_value=float(curr_bal))
+                    pay_mode = st.selectbox("Payment Mode", PAYMENT_MODES)
+                    note = st.text_input("Note (Optional)")
+                    if st.form_submit_button("Confirm Payment"):
+                        if update_balance(sel_inv_pay, pay_amt, pay_mode):
+                            log_action("Settlement", f"{sel_inv_pay} - {pay_amt}")
+                            st.session_state.receipt_data = {"date": datetime.now().strftime("%Y-%m-%d"), "inv": sel_inv_pay, "cust": cust_name, "amt": pay_amt, "mode": pay_mode, "bal": curr_bal - pay_amt}
+                            st.rerun()
+                        else: st.error("Error updating database.")
 
 # --- PURCHASE ---
 elif menu == "Purchase":
     st.title("🚚 Purchase & Stock In")
-    t1, t2 = st.tabs(["New Entry", "History & Delete"])
+    t1, t2, t3 = st.tabs(["New Entry", "History & Delete", "Bulk Import"])
     with t1:
         mode = st.radio("Select Action", ["Restock Existing Product", "Register New Product"], horizontal=True)
         st.divider()
@@ -703,10 +2467,8 @@ elif menu == "Purchase":
         if mode == "Restock Existing Product":
             df = get_inv()
             if not df.empty:
-                df['Display'] = df['Product Name'] + " | " + df['NSP Code']
-                sel_display = st.selectbox("Select Product", df['Display'].unique())
-                if sel_display:
-                    sel_prod = df[df['Display'] == sel_display].iloc[0]
+                sel_prod = product_picker(df, "restock_pick", "Select Product")
+                if sel_prod is not None:
                     c1, c2 = st.columns(2)
                     p_code = c1.text_input("NSP Code", value=sel_prod['NSP Code'], disabled=True)
                     p_name = c2.text_input("Product Name", value=sel_prod['Product Name'], disabled=True)
@@ -724,9 +2486,9 @@ elif menu == "Purchase":
                         else:
                             d = datetime.now().strftime("%Y-%m-%d")
                             if update_product_master(p_code, p_name, input_cp, input_sp):
-                                save_entry("Purchase", {"NSP Code": p_code, "Product Name": p_name, "Date": d, "Qty": qty, "Location": loc, "Vendor Name": vendor_name, "Cost Price": input_cp, "Selling Price": input_sp})
-                                save_entry("Vendor_Payments", {"Payment ID": f"PEND-{int(time.time())}", "Date": d, "Vendor Name": vendor_name, "Amount": input_cp * qty, "Status": "Pending", "Notes": f"Restock {p_code}"})
-                                st.success("Restocked & Payment Logged!"); st.rerun()
+                                if save_entries("Purchase", [{"NSP Code": p_code, "Product Name": p_name, "Date": d, "Qty": qty, "Location": loc, "Vendor Name": vendor_name, "Cost Price": input_cp, "Selling Price": input_sp}]) and \
+                                   save_entries("Vendor_Payments", [{"Payment ID": f"PEND-{int(time.time())}", "Date": d, "Vendor Name": vendor_name, "Amount": input_cp * qty, "Status": "Pending", "Notes": f"Restock {p_code}"}]):
+                                    st.success("Restocked & Payment Logged!"); st.rerun()
 
         else: 
             c1, c2 = st.columns(2)
@@ -744,29 +2506,47 @@ elif menu == "Purchase":
                 else:
                     d = datetime.now().strftime("%Y-%m-%d")
                     if update_product_master(code, name, st.session_state.p_cp, st.session_state.p_sp):
-                        save_entry("Purchase", {"NSP Code": code, "Product Name": name, "Date": d, "Qty": qty, "Location": loc, "Vendor Name": vendor_name, "Cost Price": st.session_state.p_cp, "Selling Price": st.session_state.p_sp})
-                        save_entry("Vendor_Payments", {"Payment ID": f"PEND-{int(time.time())}", "Date": d, "Vendor Name": vendor_name, "Amount": st.session_state.p_cp * qty, "Status": "Pending", "Notes": f"New: {code}"})
-                        st.success("New Product Registered & Stocked!"); st.rerun()
+                        if save_entries("Purchase", [{"NSP Code": code, "Product Name": name, "Date": d, "Qty": qty, "Location": loc, "Vendor Name": vendor_name, "Cost Price": st.session_state.p_cp, "Selling Price": st.session_state.p_sp}]) and \
+                           save_entries("Vendor_Payments", [{"Payment ID": f"PEND-{int(time.time())}", "Date": d, "Vendor Name": vendor_name, "Amount": st.session_state.p_cp * qty, "Status": "Pending", "Notes": f"New: {code}"}]):
+                            st.success("New Product Registered & Stocked!"); st.rerun()
     with t2:
-        df_p = load_data("Purchase")
-        df_prods = load_data("Products")
+        data = load_many("Purchase", "Products")
+        df_p = data["Purchase"]; df_prods = data["Products"]
         if not df_p.empty and not df_prods.empty:
             cols_to_drop = [c for c in ['Product Name', 'Cost Price', 'Selling Price'] if c in df_p.columns]
-            df_p_clean = df_p.drop(columns=cols_to_drop)
-            df_merged = pd.merge(df_p_clean, df_prods[['NSP Code', 'Product Name', 'Cost Price', 'Selling Price']], on='NSP Code', how='left')
-            render_filtered_table(df_merged, "purch")
+            df_merged = derive("purchase_view", (df_p, df_prods), lambda p, pr: pd.merge(p.drop(columns=cols_to_drop), pr[['NSP Code', 'Product Name', 'Cost Price', 'Selling Price']], on='NSP Code', how='left'))
+            render_filtered_table(df_merged, "purch", (sheet_version("Purchase"), sheet_version("Products"), len(df_merged)))
         else:
-            render_filtered_table(df_p, "purch")
+            render_filtered_table(df_p, "purch", (sheet_version("Purchase"), len(df_p)))
         
         if not df_p.empty:
             st.divider()
-            del_options = [f"Row {i+2} | {r['Date']} | {r['NSP Code']}" for i, r in df_p.iterrows()]
+            del_options = ("Row " + (df_p.index + 2).astype(str) + " | " + df_p['Date'].astype(str) + " | " + df_p['NSP Code'].astype(str)).tolist()
             sel_del_str = st.selectbox("Select Entry to Delete", del_options)
             
             if st.button("🗑️ Delete Selected Entry"):
                 row_idx_to_delete = int(sel_del_str.split("|")[0].replace("Row", "").strip())
                 if delete_entry_by_row("Purchase", row_idx_to_delete):
                     st.success("Deleted!"); st.rerun()
+    with t3:
+        st.write("### 📥 Import Purchases or Products from Excel / CSV")
+        st.caption("Columns: NSP Code, Product Name, Qty, Location, Vendor Name, Cost Price, Selling Price, Date (Purchases); NSP Code, Product Name, Cost Price, Selling Price, Op_Shop, Op_Terrace, Op_Godown (Products). Opening columns only apply to new products.")
+        with st.form("bulk_import"):
+            kind = st.radio("Import", IMPORT_KINDS, horizontal=True)
+            up = st.file_uploader("File", type=["csv", "xlsx"])
+            c1, c2, c3 = st.columns(3)
+            def_loc = c1.selectbox("Default Location", LOCATIONS); def_vendor = c2.text_input("Default Vendor Name"); def_date = c3.date_input("Default Date")
+            if st.form_submit_button("Import", type="primary"):
+                if up is None: st.error("⚠️ Choose a file first!")
+                else:
+                    status = st.empty()
+                    try:
+                        res = bulk_import(import_chunks(up, up.name), kind, {"location": def_loc, "vendor": def_vendor, "date": def_date.strftime("%Y-%m-%d")},
+                                          progress=lambda r: status.info(f"Imported {r['rows']} rows..."))
+                        status.success(f"Imported {res['rows'] - len(res['rejected'])} of {res['rows']} rows: {res['new_products']} new products, {res['updated_products']} updated, {res['purchases']} purchases, {res['payables']} vendor payables.")
+                        log_action("Bulk Import", f"{kind} {up.name}: {res['rows']} rows, {len(res['rejected'])} rejected")
+                        if res["rejected"]: st.dataframe(pd.DataFrame(res["rejected"], columns=["File Row", "Reason"]), use_container_width=True)
+                    except Exception as e: status.error(f"Import Error: {e}")
 
 # --- QUOTATIONS ---
 elif menu == "Quotations":
@@ -782,9 +2562,8 @@ elif menu == "Quotations":
         else:
             df = get_inv()
             if not df.empty:
-                sel = st.selectbox("Item", df['Product Name'].unique(), index=None, key="q_sel")
-                if sel:
-                    it = df[df['Product Name']==sel].iloc[0]
+                it = product_picker(df, "q_sel", "Item")
+                if it is not None:
                     with st.form("q_add"):
                         q = st.number_input("Qty",1)
                         p = st.number_input("Price", value=safe_float(it.get('Selling Price',0)))
@@ -798,21 +2577,21 @@ elif menu == "Quotations":
                     cust = st.text_input("Customer Name"); ph = st.text_input("Phone")
                     if st.form_submit_button("Save & Print"):
                         qid = f"Q-{int(time.time())}"; d=datetime.now().strftime("%Y-%m-%d")
-                        for x in st.session_state.cart:
-                            save_entry("Quotations", {"Quote ID":qid, "Date":d, "Customer Name":cust, "Phone":ph, "NSP Code":x['NSP Code'], "Product Name":x['Product Name'], "Qty":x['Qty'], "Price":x['Price'], "Total":x['Total']})
-                        st.session_state.print_data = {"inv":qid, "cust":cust, "phone":ph, "date":d, "items":st.session_state.cart} 
-                        st.session_state.cart=[]; st.rerun()
+                        lines = [{"Quote ID":qid, "Date":d, "Customer Name":cust, "Phone":ph, "NSP Code":x['NSP Code'], "Product Name":x['Product Name'], "Qty":x['Qty'], "Price":x['Price'], "Total":x['Total']} for x in st.session_state.cart]
+                        if save_entries("Quotations", lines):
+                            st.session_state.print_data = {"inv":qid, "cust":cust, "phone":ph, "date":d, "items":st.session_state.cart} 
+                            st.session_state.cart=[]; st.rerun()
     with t2:
         df_q = load_data("Quotations")
-        render_filtered_table(df_q, "quote_hist")
+        render_filtered_table(df_q, "quote_hist", (sheet_version("Quotations"), len(df_q)))
         if not df_q.empty:
             c1, c2 = st.columns(2)
             sel_q = st.selectbox("Select Quote ID", df_q['Quote ID'].unique())
             if c1.button("Reprint Quote"):
-                 q_data = df_q[df_q['Quote ID'] == sel_q]
+                 q_data = rows_for(df_q, "Quotations", sel_q)
                  if not q_data.empty:
                     first = q_data.iloc[0]
-                    items = [{"Product Name":r['Product Name'],"NSP Code":r['NSP Code'],"Qty":r['Qty'],"Price":r['Price'],"Discount":0} for i,r in q_data.iterrows()]
+                    items = line_items(q_data, discount=False)
                     st.session_state.print_data = {"inv": sel_q, "cust": first['Customer Name'], "phone": first['Phone'], "date": first['Date'], "items": items}
                     st.rerun()
             if c2.button("❌ Delete Quote"):
@@ -833,7 +2612,7 @@ elif menu == "Manufacturing":
                 st.success("Order Created!"); st.rerun()
     with t2:
         df_m = load_data("Manufacturing")
-        render_filtered_table(df_m, "mfg")
+        render_filtered_table(df_m, "mfg", (sheet_version("Manufacturing"), len(df_m)))
         if not df_m.empty:
             del_m = st.selectbox("Select Order to Delete", df_m['Order No'].unique())
             if st.button("Delete Order"):
@@ -851,7 +2630,7 @@ elif menu == "Vendor Payments":
                 st.success("Saved"); st.rerun()
     with t2:
         df_v = load_data("Vendor_Payments")
-        render_filtered_table(df_v, "vp")
+        render_filtered_table(df_v, "vp", (sheet_version("Vendor_Payments"), len(df_v)))
         if not df_v.empty:
             del_v = st.selectbox("Select Payment to Delete", df_v['Payment ID'].unique())
             if st.button("Delete Payment"):
@@ -862,10 +2641,8 @@ elif menu == "Stock Transfer":
     st.title("🚚 Transfer")
     df = get_inv()
     if not df.empty:
-        df['S'] = df['Product Name'] + " | " + df['NSP Code']
-        sel = st.selectbox("Select Product", df['S'].unique())
-        if sel:
-            it = df[df['S']==sel].iloc[0]
+        it = product_picker(df, "tf_pick", "Select Product")
+        if it is not None:
             st.info(f"Shop: {it['Shop']} | Terrace: {it['Terrace Godown']} | Godown: {it['Big Godown']}")
             with st.form("tf"):
                 f = st.selectbox("From", LOCATIONS); t = st.selectbox("To", LOCATIONS); q = st.number_input("Qty",1)
@@ -882,7 +2659,7 @@ elif menu == "Products":
     
     with t1:
         df = load_data("Products")
-        render_filtered_table(df, "prods")
+        render_filtered_table(df, "prods", (sheet_version("Products"), len(df)))
         
     with t2:
         st.write("### Add Product Manually (Without Purchase)")
@@ -910,5 +2687,35 @@ elif menu == "Products":
 elif menu == "Logs":
     st.title("📜 Logs")
     df = load_data("Logs")
-    render_filtered_table(df, "logs") 
+    render_filtered_table(df, "logs", (sheet_version("Logs"), len(df))) 
+
+# --- DIAGNOSTICS (owner only) ---
+elif menu == "Diagnostics":
+    st.title("🩺 Diagnostics")
+    m = metrics()
+    with m.lock: history = [dict(r) for r in m.history]; pages = {p: {"reruns": v["reruns"], "ops": {k: dict(o) for k, o in v["ops"].items()}, "cache": dict(v["cache"])} for p, v in m.pages.items()}
+    st.caption(f"Reruns since start-up or reset, the last {RUN_HISTORY} kept in detail. Times are inclusive, so nested ops overlap.")
+    per_page = []
+    for p, v in pages.items():
+        calls, rows, ms = api_totals(v["ops"])
+        hits = sum(h for h, _ in v["cache"].values()); looks = hits + sum(x for _, x in v["cache"].values())
+        per_page.append({"Page": p, "Reruns": v["reruns"], "API calls": calls, "API calls / rerun": round(calls / v["reruns"], 2) if v["reruns"] else None,
+                         "Rows moved": rows, "API ms": round(ms, 1), "Cache hit %": round(100 * hits / looks, 1) if looks else None})
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Reruns", sum(v["reruns"] for v in pages.values()))
+    c2.metric("Sheets API calls", sum(r["API calls"] for r in per_page))
+    c3.metric("Sheets rows moved", sum(r["Rows moved"] for r in per_page))
+    st.markdown("### Quota by page")
+    st.dataframe(pd.DataFrame(per_page).sort_values("API calls", ascending=False) if per_page else pd.DataFrame(), use_container_width=True)
+    if pages:
+        sel_page = st.selectbox("Page detail", sorted(pages))
+        st.dataframe(ops_frame(pages[sel_page]["ops"]), use_container_width=True)
+        cache = pages[sel_page]["cache"]
+        if cache: st.dataframe(pd.DataFrame([{"Sheet": k, "Hits": h, "Misses": x} for k, (h, x) in cache.items()]), use_container_width=True)
+    st.markdown("### Recent reruns")
+    st.dataframe(pd.DataFrame([run_summary(r) for r in reversed(history[-100:])]), use_container_width=True)
+    c1, c2 = st.columns(2)
+    c1.download_button("⬇️ Export reruns (JSON lines)", "\n".join(json.dumps(r, default=str) for r in history), file_name=f"nexus_metrics_{datetime.now():%Y%m%d_%H%M}.jsonl", mime="application/x-ndjson")
+    if c2.button("Reset counters"): m.reset(); st.rerun()
 
+metrics().end_run()
@@ -0,0 +1,119 @@
+"""
+In-memory stand-in for the parts of gspread's Spreadsheet/Worksheet API that app.py uses.
+Cells are stored as text, like a RAW sheet. Every API method bumps a per-spreadsheet call
+counter so the benchmarks can report how many round trips an operation would cost.
+"""
+from collections import Counter
+
+import gspread
+from gspread.utils import a1_range_to_grid_range
+
+
+class FakeWorksheet:
+    def __init__(self, sh, title, sheet_id):
+        self.sh = sh; self.title = title; self.id = sheet_id; self.rows = []
+
+    def _call(self, name): self.sh.calls[name] += 1
+
+    def _width(self): return max((len(r) for r in self.rows), default=0)
+
+    @property
+    def col_count(self): return max(26, self._width())
+
+    @property
+    def row_count(self): return max(1000, len(self.rows))  # grid size: a new sheet has 1000 rows, blank or not
+
+    def _grid(self, a1):
+        """Values of an A1 range with trailing empty cells and rows trimmed, as the Sheets API returns them."""
+        g = a1_range_to_grid_range(a1.split("!")[-1])
+        r0 = g.get("startRowIndex", 0); r1 = g.get("endRowIndex", len(self.rows))
+        c0 = g.get("startColumnIndex", 0); c1 = g.get("endColumnIndex", self._width())
+        out = []
+        for row in self.rows[r0:r1]:
+            vals = row[c0:c1]
+            while vals and vals[-1] == "": vals = vals[:-1]
+            out.append(vals)
+        while out and not out[-1]: out.pop()
+        return out
+
+    def _set(self, r, c, value):
+        while len(self.rows) < r: self.rows.append([])
+        row = self.rows[r - 1]
+        while len(row) < c: row.append("")
+        row[c - 1] = str(value)
+
+    def row_values(self, row, **kw):
+        self._call("row_values")
+        return list(self.rows[row - 1]) if len(self.rows) >= row else []
+
+    def col_values(self, col, **kw):
+        self._call("col_values")
+        vals = [r[col - 1] if len(r) >= col else "" for r in self.rows]
+        while vals and vals[-1] == "": vals.pop()
+        return vals
+
+    def get_all_values(self, **kw):
+        self._call("get_all_values")
+        return [list(r) for r in self.rows]
+
+    def get(self, a1=None, **kw):
+        self._call("get")
+        return self._grid(a1) if a1 else [list(r) for r in self.rows]
+
+    def batch_get(self, ranges, **kw):
+        self._call("batch_get")
+        return [self._grid(a1) for a1 in ranges]
+
+    def append_row(self, values, **kw):
+        self._call("append_row"); self.rows.append([str(v) for v in values])
+
+    def append_rows(self, values, **kw):
+        self._call("append_rows"); self.rows.extend([str(v) for v in row] for row in values)
+
+    def update_cell(self, row, col, value):
+        self._call("update_cell"); self._set(row, col, value)
+
+    def batch_update(self, data, **kw):
+        self._call("batch_update")
+        for d in data:
+            g = a1_range_to_grid_range(d["range"])
+            for i, row in enumerate(d["values"]):
+                for j, v in enumerate(row): self._set(g["startRowIndex"] + 1 + i, g["startColumnIndex"] + 1 + j, v)
+
+    def add_cols(self, cols): self._call("add_cols")
+
+    def delete_rows(self, start, end=None):
+        self._call("delete_rows"); del self.rows[start - 1:(end or start)]
+
+
+class FakeSpreadsheet:
+    def __init__(self):
+        self.calls = Counter(); self.sheets = {}
+
+    def load(self, title, header, rows):
+        """Create (or replace) a worksheet with a header row and data rows, without counting API calls."""
+        ws = self.sheets.get(title) or FakeWorksheet(self, title, len(self.sheets) + 1)
+        ws.rows = [list(header)] + [[str(v) for v in r] for r in rows]
+        self.sheets[title] = ws
+        return ws
+
+    def worksheet(self, title):
+        self.calls["worksheet"] += 1
+        if title not in self.sheets: raise gspread.exceptions.WorksheetNotFound(title)
+        return self.sheets[title]
+
+    def worksheets(self):
+        self.calls["worksheets"] += 1
+        return list(self.sheets.values())
+
+    def add_worksheet(self, title, rows, cols, **kw):
+        self.calls["add_worksheet"] += 1
+        self.sheets[title] = FakeWorksheet(self, title, len(self.sheets) + 1)
+        return self.sheets[title]
+
+    def batch_update(self, body):
+        self.calls["spreadsheet_batch_update"] += 1
+        by_id = {ws.id: ws for ws in self.sheets.values()}
+        for req in body["requests"]:
+            rng = req["deleteDimension"]["range"]
+            del by_id[rng["sheetId"]].rows[rng["startIndex"]:rng["endIndex"]]
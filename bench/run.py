@@ -0,0 +1,110 @@
+"""
+Benchmarks for the hot paths of app.py on synthetic sheets of growing size.
+
+    python -m bench.run                                   # 1k and 10k rows
+    python -m bench.run --sizes 1000 10000 100000 1000000 --json bench.json
+
+app.py is executed under a name other than __main__, which stops it where the page starts (definitions
+only), with the storage backend pointed at an in-memory FakeSpreadsheet, writing through (no outbox). Every operation is run
+twice on identical fresh data: once for wall time, once under tracemalloc for peak memory, which
+would otherwise inflate the timings. API calls are counted on the timed run.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+import tracemalloc
+import warnings
+
+from bench import synth
+from bench.fake_gspread import FakeSpreadsheet
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def load_app(path=APP):
+    """app.py's definitions: the script raises its DefinitionsOnly where the page starts unless run as __main__."""
+    with open(path, encoding="utf-8") as f: code = compile(f.read(), path, "exec")
+    ns = {"__name__": "nexus_bench", "__file__": path}
+    try: exec(code, ns)
+    except Exception as e:
+        if not isinstance(e, ns.get("DefinitionsOnly", ())): raise
+    else: raise RuntimeError(f"{path} ran to the end without stopping before its page code")
+    return ns
+
+
+def fresh(app, data):
+    """New FakeSpreadsheet holding data, with the app's process-wide caches cleared and pointed at it."""
+    sh = FakeSpreadsheet()
+    for title, (header, rows) in data.items(): sh.load(title, header, rows)
+    app["st"].cache_resource.clear()
+    backend = app["SheetsBackend"](sh)
+    app["get_backend"] = lambda: backend
+    app["get_outbox"] = lambda: None
+    return sh
+
+
+def cases(data):
+    """(name, setup, op) in run order; each setup(app) returns the argument op(app, arg) is called with."""
+    sales = data["Sales"][1]
+    settle_inv = next(r[0] for r in sales[len(sales) // 2:] if float(r[15]) > 0)
+    delete_inv = sales[len(sales) // 3][0]
+    line = dict(zip(synth.SALES_COLS, sales[-1])); line["Invoice No"] = "INV-BENCH"
+    none = lambda app: None
+    return [
+        ("get_inv (cold)", none, lambda app, _: app["get_inv"]()),
+        ("get_inv (warm)", none, lambda app, _: app["get_inv"]()),
+        ("save_entry (sale line)", none, lambda app, _: app["save_entry"]("Sales", line)),
+        ("get_inv (after append)", none, lambda app, _: app["get_inv"]()),
+        ("update_balance", none, lambda app, _: app["update_balance"](settle_inv, 1.0)),
+        ("delete_entry (invoice)", none, lambda app, _: app["delete_entry"]("Sales", "Invoice No", delete_inv)),
+        ("render_filtered_table (Sales)", lambda app: app["load_data"]("Sales"), lambda app, df: app["render_filtered_table"](df, "bench")),
+    ]
+
+
+def run_pass(app, data, traced):
+    sh = fresh(app, data); out = {}
+    for name, setup, op in cases(data):
+        arg = setup(app); sh.calls.clear()
+        if traced: tracemalloc.start()
+        t = time.perf_counter()
+        op(app, arg)
+        wall = time.perf_counter() - t
+        if traced: out[name] = tracemalloc.get_traced_memory()[1]; tracemalloc.stop()
+        else: out[name] = (wall, dict(sh.calls))
+    return out
+
+
+def bench(app, rows, seed=0):
+    data = synth.shop(rows, seed)
+    timed = run_pass(app, data, traced=False)
+    peaks = run_pass(app, data, traced=True)
+    return [{"rows": rows, "op": name, "wall_ms": round(wall * 1000, 2), "peak_mb": round(peaks[name] / 2**20, 2),
+             "api_calls": sum(calls.values()), "calls": calls} for name, (wall, calls) in timed.items()]
+
+
+def report(results):
+    print(f"{'rows':>9}  {'operation':<30} {'wall ms':>10} {'peak MB':>9} {'calls':>6}  detail")
+    for r in results:
+        detail = ", ".join(f"{k}x{v}" for k, v in sorted(r["calls"].items()))
+        print(f"{r['rows']:>9}  {r['op']:<30} {r['wall_ms']:>10.2f} {r['peak_mb']:>9.2f} {r['api_calls']:>6}  {detail}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="rows per movement sheet (e.g. 1000 10000 100000 1000000)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--json", help="also write the results to this file")
+    args = ap.parse_args(argv)
+    # Streamlit warns about running without `streamlit run` on every st.* call; keep the report readable.
+    logging.disable(logging.WARNING); warnings.filterwarnings("ignore")
+    app = load_app()
+    results = [r for rows in args.sizes for r in bench(app, rows, args.seed)]
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f: json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
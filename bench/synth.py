@@ -0,0 +1,76 @@
+"""
+Deterministic synthetic shop data: the same seed and size always give the same sheets.
+Column layouts follow the ones app.py writes (Products, Purchase, Sales, Transfers).
+"""
+import random
+from datetime import date, timedelta
+
+LOCATIONS = ["Shop", "Terrace Godown", "Big Godown"]
+WORDS = ["Chair", "Table", "Sofa", "Office", "Wooden", "Steel", "Revolving", "Dining", "Bed", "King",
+         "Queen", "Plastic", "Glass", "Desk", "Rack", "Cabinet", "Recliner", "Stool", "Wardrobe", "Mirror"]
+CUSTOMERS = ["Ramesh", "Suresh", "Anita", "Kiran", "Meena", "Farhan", "Joseph", "Priya", "Vikas", "Leela"]
+
+PRODUCT_COLS = ["NSP Code", "Product Name", "Cost Price", "Selling Price", "Op_Shop", "Op_Terrace", "Op_Godown"]
+PURCHASE_COLS = ["Date", "NSP Code", "Product Name", "Qty", "Cost Price", "Selling Price", "Location", "Vendor Name"]
+SALES_COLS = ["Invoice No", "Date", "Customer Name", "Phone", "Address", "Bill Type", "Customer GST", "Salesman",
+              "NSP Code", "Product Name", "Qty", "Price", "Discount", "Total", "Paid", "Balance", "Mode", "Location"]
+TRANSFER_COLS = ["Date", "NSP Code", "From_Loc", "To_Loc", "Qty"]
+
+
+def product_count(rows): return max(100, rows // 10)
+
+
+def dates(rng, n, start=date(2024, 4, 1), days=730):
+    return [(start + timedelta(days=d)).isoformat() for d in sorted(rng.randrange(days) for _ in range(n))]
+
+
+def products(rng, n):
+    out = []
+    for i in range(n):
+        sp = rng.randrange(500, 50000, 50)
+        out.append([f"NSP{i:06d}", " ".join(rng.sample(WORDS, 3)), sp // 3 if rng.random() < 0.8 else 0, sp,
+                    rng.randrange(0, 20), rng.randrange(0, 10), rng.randrange(0, 40)])
+    return out
+
+
+def purchases(rng, n, prods):
+    return [[d, p[0], p[1], rng.randrange(1, 30), p[2], p[3], rng.choice(LOCATIONS), f"Vendor {rng.randrange(40)}"]
+            for d, p in zip(dates(rng, n), (rng.choice(prods) for _ in range(n)))]
+
+
+def sales(rng, n, prods):
+    """About n rows of multi-line invoices (1-5 lines each); roughly a quarter carry a balance."""
+    out = []; inv = 0
+    for d in dates(rng, max(1, n // 3)):
+        inv += 1; lines = [rng.choice(prods) for _ in range(rng.randrange(1, 6))]
+        gst = rng.random() < 0.3
+        qty = [rng.randrange(1, 4) for _ in lines]
+        total = sum(q * p[3] for q, p in zip(qty, lines)) * (1.18 if gst else 1)
+        paid = total if rng.random() < 0.75 else round(total * rng.random(), 2)
+        cust = rng.choice(CUSTOMERS); phone = f"98{rng.randrange(10**8):08d}"
+        for q, p in zip(qty, lines):
+            out.append([f"INV-{inv:07d}", d, cust, phone, "", "GST" if gst else "Non-GST",
+                        "27ABCDE1234F1Z5" if gst else "", "Owner", p[0], p[1], q, p[3], 0, q * p[3],
+                        paid, round(total - paid, 2), "Cash", rng.choice(LOCATIONS)])
+            if len(out) >= n: return out
+    return out
+
+
+def transfers(rng, n, prods):
+    out = []
+    for d in dates(rng, n):
+        p = rng.choice(prods); src, dst = rng.sample(LOCATIONS, 2)
+        out.append([d, p[0], src, dst, rng.randrange(1, 10)])
+    return out
+
+
+def shop(rows, seed=0):
+    """{sheet: (header, rows)} with `rows` purchases and sales rows, rows // 4 transfers and product_count(rows) products."""
+    rng = random.Random(seed)
+    prods = products(rng, product_count(rows))
+    return {
+        "Products": (PRODUCT_COLS, prods),
+        "Purchase": (PURCHASE_COLS, purchases(rng, rows, prods)),
+        "Sales": (SALES_COLS, sales(rng, rows, prods)),
+        "Transfers": (TRANSFER_COLS, transfers(rng, rows // 4, prods)),
+    }
@@ -0,0 +1,36 @@
+"""
+PDF rendering for the batch invoice export, kept out of app.py so process-pool workers can import it.
+
+Streamlit runs app.py as a stand-in __main__ module, and a spawned worker rebuilds __main__ before it
+does anything else, which would re-run the whole app (sheet connection included) in every worker.
+write_pdfs therefore runs the pool in a child Python with this file as its script: the workers rebuild
+that __main__, which is nothing but this file, and the app process's own modules are never touched.
+"""
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+def write_pdf(html, path):
+    """Render one HTML page to a PDF at path and return the path."""
+    from weasyprint import HTML
+    HTML(string=html).write_pdf(path)
+    return path
+
+def write_pdfs(jobs, workers):
+    """Render (html, path) pairs across `workers` spawned processes; returns the paths in job order."""
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}  # the child imports what this process can
+    done = subprocess.run([sys.executable, __file__, str(workers)], input=json.dumps(jobs), capture_output=True, text=True, env=env)
+    if done.returncode: raise RuntimeError("PDF export failed: " + (done.stderr.strip().splitlines() or [f"exit {done.returncode}"])[-1])
+    return json.loads(done.stdout)
+
+def run_pool(jobs, workers):
+    htmls, paths = zip(*jobs)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return list(pool.map(write_pdf, htmls, paths, chunksize=max(1, len(jobs) // (workers * 4))))
+
+if __name__ == "__main__":
+    # Entry point for write_pdfs: jobs as JSON on stdin, the paths written as JSON on stdout.
+    json.dump(run_pool(json.load(sys.stdin), int(sys.argv[1])), sys.stdout)
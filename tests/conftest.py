@@ -0,0 +1,39 @@
+"""
+Fixtures for the tests: app.py loaded the way bench/run.py loads it (definitions only), pointed at
+synthetic shop data on the in-memory fake spreadsheet or on an in-memory SQLite backend.
+"""
+import logging
+import os
+import sys
+import warnings
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import synth
+from bench.run import fresh, load_app
+
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+
+@pytest.fixture(scope="session")
+def app():
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return load_app()
+
+
+@pytest.fixture(scope="session")
+def data(): return synth.shop(1000, seed=1)
+
+
+@pytest.fixture(params=["sheets", "sqlite"])
+def shop(request, app, data):
+    """app with empty process-wide caches, reading and writing a fresh copy of data on either backend."""
+    fresh(app, data)
+    if request.param == "sqlite":
+        be = app["SqliteBackend"](":memory:")
+        for title, (header, rows) in data.items(): be.append(title, [dict(zip(header, map(str, r))) for r in rows])
+        app["get_backend"] = lambda: be
+    return app
@@ -0,0 +1,30 @@
+"""bench/fake_gspread and SqliteBackend: the same sheets read, written and deleted through either backend."""
+import pandas as pd
+import pytest
+
+from bench.run import fresh, load_app
+
+
+def test_backends_load_the_same_frames(app, data):
+    fresh(app, data)
+    sheets = {s: app["load_data"](s) for s in data}
+    be = app["SqliteBackend"](":memory:")
+    for title, (header, rows) in data.items(): be.append(title, [dict(zip(header, map(str, r))) for r in rows])
+    app["st"].cache_resource.clear(); app["get_backend"] = lambda: be
+    for s, df in sheets.items(): pd.testing.assert_frame_equal(app["load_data"](s), df)
+
+
+def test_append_and_delete_round_trip(shop):
+    sales = shop["load_data"]("Sales"); inv = sales['Invoice No'].iloc[len(sales) // 2]
+    line = {**sales.iloc[0].to_dict(), 'Invoice No': "INV-RT"}
+    assert shop["save_entries"]("Sales", [line, line])
+    assert (shop["load_data"]("Sales")['Invoice No'] == "INV-RT").sum() == 2
+    assert shop["delete_entry"]("Sales", "Invoice No", inv)
+    after = shop["load_data"]("Sales")
+    assert len(after) == len(sales) + 2 - (sales['Invoice No'] == inv).sum() and inv not in set(after['Invoice No'])
+
+
+def test_load_app_stops_before_the_page(app, tmp_path):
+    assert "export_invoices" in app and "menu" not in app
+    script = tmp_path / "app.py"; script.write_text("x = 1\nmenu = 'Dashboard'\n")  # no guard: the page would run
+    with pytest.raises(RuntimeError): load_app(str(script))
@@ -0,0 +1,26 @@
+"""Batch PDF export: workers render in separate processes without re-running the app or touching this process's __main__."""
+import datetime
+import os
+import sys
+import types
+
+from bench.run import fresh
+
+FAKE_WEASYPRINT = '''import os
+class HTML:
+    def __init__(self, string): self.s = string
+    def write_pdf(self, path): open(path, "w").write(f"{os.getpid()}:{len(self.s)}")
+'''
+
+
+def test_pdf_batch_renders_in_workers(app, data, tmp_path, monkeypatch):
+    fresh(app, data)
+    (tmp_path / "weasyprint.py").write_text(FAKE_WEASYPRINT); monkeypatch.syspath_prepend(str(tmp_path))
+    main = types.ModuleType("__main__"); main.__file__ = str(tmp_path / "app_main.py")  # what Streamlit runs
+    (tmp_path / "app_main.py").write_text(f"open({str(tmp_path / 'RERUN')!r}, 'w')\n")
+    monkeypatch.setitem(sys.modules, "__main__", main)
+    docs = app["invoices_between"](app["load_data"]("Sales"), datetime.date(2000, 1, 1), datetime.date(2100, 1, 1))[:20]
+    paths = app["export_invoices"](docs, str(tmp_path / "out"), "pdf", workers=2)
+    assert [os.path.basename(p) for p in paths] == [str(d["inv"]).replace("/", "_") + ".pdf" for d in docs]
+    assert os.getpid() not in {int(open(p).read().split(":")[0]) for p in paths}
+    assert not (tmp_path / "RERUN").exists() and sys.modules["__main__"] is main
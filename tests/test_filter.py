@@ -0,0 +1,20 @@
+"""Column views behind render_filtered_table's filters, and the derived frames they are cached for."""
+import pandas as pd
+
+
+def test_column_views_are_per_frame(app):
+    app["st"].cache_resource.clear(); view = app["column_view"]
+    a = pd.DataFrame({"x": ["p", "q", "p"]}); b = pd.DataFrame({"x": ["r", "s"]})
+    assert view(a, "x", "t", 1)[1] == ["p", "q"]
+    assert view(b, "x", "t", 1)[1] == ["r", "s"]  # same key and version, different frame
+    assert view(b, "x", "t", 1)[0] is view(b, "x", "t", 1)[0]
+    assert view(b, "x", "t", 2)[0] is not view(b, "x", "t", 1)[0]
+
+
+def test_derive_reuses_while_inputs_are_the_same_frames(app):
+    app["st"].cache_resource.clear(); builds = []
+    build = lambda df: builds.append(1) or df.assign(y=1)
+    a = pd.DataFrame({"x": [1]}); b = pd.DataFrame({"x": [2]})
+    first = app["derive"]("t", (a,), build)
+    assert app["derive"]("t", (a,), build) is first and len(builds) == 1
+    assert app["derive"]("t", (b,), build)['x'].tolist() == [2] and len(builds) == 2
@@ -0,0 +1,24 @@
+"""Bulk import from CSV and Excel: rejected rows are reported by their row in the file."""
+import io
+
+import openpyxl
+
+CSV = "NSP Code,Product Name,Qty,Location,Vendor Name\nA1,Widget,1,Shop,V\n\n\nA2,,1,Shop,V\n,,,,\n,x,1,Shop,V\n\nA3,Gadget,-1,Shop,V\n"
+REJECTED = [(5, "new code A2 has no Product Name"), (7, "no NSP Code"), (9, "Qty must be a positive number")]
+DEFAULTS = {"location": "Shop", "vendor": "V", "date": "2026-01-01"}
+
+
+def xlsx(text):
+    wb = openpyxl.Workbook(); ws = wb.active
+    for i, line in enumerate(text.splitlines(), 1):
+        for j, v in enumerate(line.split(","), 1):
+            if v: ws.cell(i, j, v)
+    buf = io.BytesIO(); wb.save(buf); buf.seek(0)
+    return buf
+
+
+def test_file_rows_count_blank_lines(shop, monkeypatch):
+    monkeypatch.setitem(shop, "IMPORT_CHUNK", 2)  # blank lines on both sides of chunk edges
+    for name, f in (("f.csv", io.BytesIO(CSV.encode())), ("f.xlsx", xlsx(CSV))):
+        res = shop["bulk_import"](shop["import_chunks"](f, name), "Purchases", DEFAULTS)
+        assert res["rows"] == 4 and res["rejected"] == REJECTED and res["purchases"] == 1, name
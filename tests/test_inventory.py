@@ -0,0 +1,47 @@
+"""get_inv against the row-by-row stock computation it replaced, and the stock snapshot against a rebuild."""
+import pandas as pd
+
+
+def baseline_inv(app):
+    """Stock per location the way get_inv computed it before the movement ledger: row by row over copies."""
+    safe_float, locations = app["safe_float"], app["LOCATIONS"]
+    p = app["load_data"]("Products").copy()
+    p['Selling Price'] = p['Selling Price'].apply(safe_float); p['Cost Price'] = p['Cost Price'].apply(safe_float)
+    p['Clean'] = p['NSP Code'].astype(str).str.strip().str.lower()
+    for loc in locations: p[loc] = 0.0
+    for loc, col_name in app["OPENING_BAL_COLS"].items(): p[loc] += p[col_name].apply(safe_float)
+    for sheet, sign in (("Purchase", 1), ("Sales", -1)):
+        df = app["load_data"](sheet)
+        for code, loc, qty in zip(df['NSP Code'], df['Location'], df['Qty']):
+            if loc in locations: p.loc[p['Clean'] == str(code).strip().lower(), loc] += sign * safe_float(qty)
+    tr = app["load_data"]("Transfers")
+    for code, src, dst, qty in zip(tr['NSP Code'], tr['From_Loc'], tr['To_Loc'], tr['Qty']):
+        if src in locations and dst in locations:
+            rows = p['Clean'] == str(code).strip().lower()
+            p.loc[rows, src] -= safe_float(qty); p.loc[rows, dst] += safe_float(qty)
+    p['Total Stock'] = p[locations].sum(axis=1)
+    cp0 = (p['Cost Price'] == 0) & (p['Selling Price'] > 0)
+    p.loc[cp0, 'Cost Price'] = p.loc[cp0, 'Selling Price'] / 3.3
+    return p
+
+
+def stock(app, inv): return inv[["NSP Code", *app["LOCATIONS"], "Total Stock", "Cost Price"]].reset_index(drop=True)
+
+
+def test_get_inv_matches_baseline(shop):
+    pd.testing.assert_frame_equal(stock(shop, shop["get_inv"]()), stock(shop, baseline_inv(shop)), check_dtype=False)
+
+
+def test_snapshot_patches_match_rebuild(shop):
+    base = stock(shop, shop["get_inv"]()).copy(); snap = shop["stock_snapshot"](); held = snap.net
+    code = base['NSP Code'].iloc[0]; day = "2026-04-01"
+    assert shop["save_entry"]("Purchase", {"Date": day, "NSP Code": code, "Product Name": "x", "Qty": 7, "Location": "Big Godown", "Vendor Name": "V"})
+    assert shop["save_entry"]("Transfers", {"Date": day, "NSP Code": code, "From_Loc": "Big Godown", "To_Loc": "Shop", "Qty": 3})
+    assert shop["save_entry"]("Transfers", {"Date": day, "NSP Code": code, "From_Loc": "Nowhere", "To_Loc": "Shop", "Qty": 5})
+    line = {**shop["load_data"]("Sales").iloc[0].to_dict(), "Invoice No": "INV-T1", "NSP Code": code, "Qty": 2, "Location": "Shop"}
+    assert shop["save_entries"]("Sales", [line])
+    after = stock(shop, shop["get_inv"]())
+    assert snap.net is held  # patched in place, not rebuilt
+    assert after.loc[0, "Shop"] == base.loc[0, "Shop"] + 1 and after.loc[0, "Big Godown"] == base.loc[0, "Big Godown"] + 4
+    shop["st"].cache_resource.clear()
+    pd.testing.assert_frame_equal(after, stock(shop, shop["get_inv"]()), check_dtype=False)
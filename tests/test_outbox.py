@@ -0,0 +1,83 @@
+"""Outbox delivery against the fake spreadsheet: replay after a restart, retries that must not duplicate rows, dead letters."""
+import json
+
+import gspread
+import requests
+
+from bench.run import fresh
+
+PURCHASE = {"Date": "2026-01-02", "NSP Code": "NSP000002", "Qty": 1, "Location": "Shop"}
+
+
+def api_error(code):
+    r = requests.Response(); r.status_code = code
+    r._content = json.dumps({"error": {"code": code, "message": "bad", "status": "x"}}).encode()
+    return gspread.exceptions.APIError(r)
+
+
+def rows(sh, title): return len(sh.sheets[title].rows) - 1
+
+
+def test_replay_delivers_pending(app, data, tmp_path):
+    sh = fresh(app, data); path = tmp_path / "outbox.jsonl"; n = rows(sh, "Purchase")
+    rec = {"id": "r1", "sheet": "Purchase", "rows": [{**PURCHASE, app["OUTBOX_ID_COL"]: "r1"}], "keys": ["r1"]}
+    path.write_text(json.dumps(rec) + "\n" + json.dumps({"id": "r2", "sheet": "Logs", "rows": [{"Action": "a"}], "keys": []}) + "\n" + json.dumps({"done": "r2"}) + "\n")
+    ob = app["Outbox"](app["get_backend"](), str(path))
+    assert ob.flush(10) and rows(sh, "Purchase") == n + 1 and "Logs" not in sh.sheets
+    assert path.read_text() == ""
+
+
+def test_replay_skips_rows_that_already_landed(app, data, tmp_path):
+    sh = fresh(app, data); be = app["get_backend"](); path = tmp_path / "outbox.jsonl"
+    sale = dict(zip(data["Sales"][0], data["Sales"][1][-1])); sale["Invoice No"] = "INV-R"
+    recs = [{"id": "p", "sheet": "Purchase", "rows": [{**PURCHASE, app["OUTBOX_ID_COL"]: "p"}], "keys": ["p"]},
+            {"id": "s", "sheet": "Sales", "rows": [sale], "keys": ["INV-R"]}]
+    for rec in recs: be.append(rec["sheet"], rec["rows"])  # delivered, but the process died before the done line
+    path.write_text("".join(json.dumps(rec) + "\n" for rec in recs))
+    n = {s: rows(sh, s) for s in ("Purchase", "Sales")}
+    assert app["Outbox"](be, str(path)).flush(10)
+    assert {s: rows(sh, s) for s in n} == n
+
+
+def test_timeout_after_write_is_not_duplicated(app, data, tmp_path):
+    sh = fresh(app, data); be = app["get_backend"](); n = rows(sh, "Purchase")
+    append = be.append; calls = []
+    def landed_then_timeout(sheet_name, recs):
+        append(sheet_name, recs); calls.append(sheet_name)
+        if len(calls) == 1: raise requests.exceptions.ReadTimeout("timed out")
+    be.append = landed_then_timeout
+    ob = app["Outbox"](be, str(tmp_path / "outbox.jsonl"))
+    ob.put("Purchase", [PURCHASE])
+    assert ob.flush(10) and rows(sh, "Purchase") == n + 1
+    assert app["OUTBOX_ID_COL"] not in app["load_data"]("Purchase").columns
+
+
+def test_rejected_batch_is_dead_lettered_without_blocking(app, data, tmp_path):
+    sh = fresh(app, data); be = app["get_backend"](); path = tmp_path / "outbox.jsonl"; n = rows(sh, "Purchase") + 1
+    append = be.append
+    def reject_bad(sheet_name, recs):
+        if any(r.get("Action") == "bad" for r in recs): raise api_error(400)
+        append(sheet_name, recs)
+    be.append = reject_bad
+    ob = app["Outbox"](be, str(path))
+    ob.put("Logs", [{"Action": "bad"}]); ob.put("Logs", [{"Action": "ok"}]); ob.put("Purchase", [PURCHASE])
+    assert ob.flush(10)
+    assert app["load_data"]("Logs")["Action"].tolist() == ["ok"] and rows(sh, "Purchase") == n and len(ob.dead) == 1
+    reopened = app["Outbox"](be, str(path))
+    assert len(reopened.dead) == 1 and not reopened.pending
+
+
+def test_repeated_business_ids_are_not_mistaken_for_landed(app, data, tmp_path):
+    sh = fresh(app, data); be = app["get_backend"]()
+    pay = {"Payment ID": "PEND-1", "Date": "2026-01-02", "Vendor Name": "V", "Amount": 10, "Status": "Pending"}
+    ob = app["Outbox"](be, str(tmp_path / "outbox.jsonl"))
+    ob.put("Vendor_Payments", [pay]); assert ob.flush(10)
+    append = be.append; failed = []
+    def timeout_before_write(sheet_name, recs):
+        if not failed: failed.append(sheet_name); raise requests.exceptions.ReadTimeout("timed out")
+        append(sheet_name, recs)
+    be.append = timeout_before_write  # a second restock in the same second, whose first write never arrived
+    ob.put("Vendor_Payments", [{**pay, "Amount": 20}])
+    assert ob.flush(10) and failed
+    ws = sh.sheets["Vendor_Payments"]; amount = ws.rows[0].index("Amount")
+    assert [r[amount] for r in ws.rows[1:]] == ["10", "20"]
@@ -0,0 +1,37 @@
+"""Period close: moving closed movements into archives and opening stock must not change anyone's stock."""
+import datetime
+
+import pandas as pd
+
+
+def stock(app): return app["get_inv"]()[["NSP Code", *app["LOCATIONS"], "Total Stock"]].reset_index(drop=True).copy()
+
+
+def test_period_close_leaves_stock_unchanged(shop):
+    before = stock(shop); n = len(shop["load_data"]("Sales"))
+    for as_of in (datetime.date(2025, 6, 30), datetime.date(2025, 12, 31)):
+        plan = shop["plan_period_close"](as_of)
+        counts = shop["apply_period_close"](plan)
+        assert counts["Sales"] == int(plan["closed"]["Sales"].sum()) > 0
+        pd.testing.assert_frame_equal(stock(shop), before, check_dtype=False)
+        assert len(shop["load_history"]("Sales")) == n
+    shop["st"].cache_resource.clear()
+    pd.testing.assert_frame_equal(stock(shop), before, check_dtype=False)
+
+
+def test_archived_invoice_rows_are_found_in_history(shop):
+    shop["apply_period_close"](shop["plan_period_close"](datetime.date(2025, 12, 31)))
+    live = shop["load_data"]("Sales"); hist = shop["load_history"]("Sales")
+    shop["rows_for"](live, "Sales", live["Invoice No"].iloc[0])  # builds the index over the live frame
+    for inv in (hist["Invoice No"].iloc[0], hist["Invoice No"].iloc[-1]):
+        got = shop["rows_for"](hist, "Sales", inv)
+        pd.testing.assert_frame_equal(got, hist[hist["Invoice No"].astype(str) == str(inv)])
+
+
+def test_queued_rows_are_found_with_the_sheet_rows(shop, tmp_path):
+    shop["get_outbox"] = lambda ob=shop["Outbox"](shop["get_backend"](), str(tmp_path / "outbox.jsonl")): ob
+    sales = shop["load_data"]("Sales"); inv = sales["Invoice No"].iloc[-1]
+    shop["get_outbox"]().put("Sales", [{**sales.iloc[-1].astype(str).to_dict(), "Invoice No": "INV-Q"}])
+    df = shop["load_data"]("Sales")
+    assert len(shop["rows_for"](df, "Sales", "INV-Q")) == 1
+    pd.testing.assert_frame_equal(shop["rows_for"](df, "Sales", inv), df[df["Invoice No"] == inv])
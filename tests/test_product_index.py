@@ -0,0 +1,20 @@
+"""Product search index reuse: positions returned by the picker must point at the frame being searched."""
+import pandas as pd
+
+
+def catalogue(n=50): return pd.DataFrame({"NSP Code": [f"NSP{i:06d}" for i in range(n)], "Product Name": [f"Widget {i}" for i in range(n)]})
+
+
+def test_reordered_catalogue_gets_its_own_positions(app):
+    app["product_index_holder"].clear()
+    df = catalogue(); flipped = df.iloc[::-1].copy()
+    assert app["product_index"](df.copy()).by_code["nsp000007"] == 7
+    idx = app["product_index"](flipped)
+    assert flipped.iloc[idx.by_code["nsp000007"]]["NSP Code"] == "NSP000007"
+    assert flipped.iloc[idx.search("Widget 7")[0]]["Product Name"] == "Widget 7"
+
+
+def test_same_content_reuses_index(app):
+    app["product_index_holder"].clear()
+    df = catalogue()
+    assert app["product_index"](df) is app["product_index"](df.copy())
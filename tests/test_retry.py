@@ -0,0 +1,50 @@
+"""QuotaHTTPClient against a scripted HTTP session: which failures are retried, and what surfaces."""
+import threading
+import time
+
+import pytest
+import requests
+
+
+class Session:
+    """Answers requests with the scripted status codes in turn, then 200."""
+    def __init__(self, *codes, delay=0.0):
+        self.codes = list(codes); self.calls = 0; self.delay = delay
+
+    def request(self, method, url, **kw):
+        self.calls += 1; time.sleep(self.delay)
+        r = requests.Response(); r.status_code = self.codes.pop(0) if self.codes else 200
+        r._content = b'{"error": {"code": %d, "message": "x", "status": "x"}}' % r.status_code
+        return r
+
+
+def client(app, session):
+    return app["QuotaHTTPClient"](None, session, quota={"max_backoff": 0.01, "burst": 100})
+
+
+def test_reads_retry_transient_errors(app):
+    s = Session(503, 429)
+    assert client(app, s).request("get", "u").status_code == 200 and s.calls == 3
+
+
+def test_writes_retry_only_quota_errors(app):
+    s = Session(429)
+    assert client(app, s).request("post", "u").status_code == 200 and s.calls == 2
+    s = Session(503)
+    with pytest.raises(app["SheetsUnavailable"]): client(app, s).request("post", "u")
+    assert s.calls == 1
+
+
+def test_exhausted_quota_and_bad_requests_surface(app):
+    with pytest.raises(app["QuotaExceeded"]): client(app, Session(*[429] * 10)).request("get", "u")
+    s = Session(400)
+    with pytest.raises(app["gspread"].exceptions.APIError): client(app, s).request("get", "u")
+    assert s.calls == 1
+
+
+def test_identical_reads_in_flight_share_one_response(app):
+    s = Session(delay=0.2); c = client(app, s); out = []
+    threads = [threading.Thread(target=lambda: out.append(c.request("get", "u", params={"a": 1}))) for _ in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert s.calls == 1 and len({id(r) for r in out}) == 1
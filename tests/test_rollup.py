@@ -0,0 +1,62 @@
+"""The daily Sales rollup patched by sales, settlements and deletes against one rebuilt from Sales history."""
+import datetime
+
+import pandas as pd
+
+TODAY = datetime.date(2026, 4, 1)
+
+
+def cells(app): return app["sync_rollup"]().frame().sort_values(app["ROLLUP_KEYS"]).reset_index(drop=True)
+
+
+def sale(inv_no, code, qty, price, paid, mode="Cash", lines=2):
+    total = qty * price * lines
+    return [{"Invoice No": inv_no, "Date": TODAY.isoformat(), "Customer Name": "Zed", "Phone": "99", "Bill Type": "Non-GST",
+             "Salesman": "Owner", "NSP Code": code, "Product Name": "x", "Qty": qty, "Price": price, "Discount": 0,
+             "Total": qty * price, "Paid": paid, "Balance": round(total - paid, 2), "Mode": mode, "Location": "Shop"}] * lines
+
+
+def assert_rebuilds_to(app, frame):
+    app["st"].cache_resource.clear()
+    pd.testing.assert_frame_equal(frame, cells(app), check_dtype=False)
+
+
+def test_sale_and_delete_match_rebuild(shop):
+    cells(shop); roll = shop["sales_rollup"](); held = roll.cells
+    sales = shop["load_data"]("Sales")
+    assert shop["save_entries"]("Sales", sale("INV-T1", sales['NSP Code'].iloc[0], 2, 100.0, 400.0))
+    assert shop["delete_entry"]("Sales", "Invoice No", sales['Invoice No'].iloc[len(sales) // 3])
+    after = cells(shop)
+    assert roll.cells is held  # patched in place, not rebuilt
+    assert_rebuilds_to(shop, after)
+
+
+def test_totals_between_dates(shop):
+    sales = shop["load_data"]("Sales"); start, end = datetime.date(2024, 6, 1), datetime.date(2024, 6, 30)
+    d = pd.to_datetime(sales['Date']).dt.date; sel = sales[(d >= start) & (d <= end)]
+    tot = shop["sync_rollup"]().between(start, end)
+    assert tot['Invoices'] == sel['Invoice No'].nunique() and round(tot['Sales'], 2) == round(shop["to_num"](sel['Total']).sum(), 2)
+
+
+def test_split_payments_and_settlements_match_rebuild(shop):
+    cells(shop); roll = shop["sales_rollup"](); held = roll.cells
+    sales = shop["load_data"]("Sales")
+    assert shop["save_entries"]("Sales", sale("INV-T2", sales['NSP Code'].iloc[0], 2, 100.0, 50.0, mode="Cash: 30.0 + UPI03: 20.0"))
+    assert shop["update_balance"]("INV-T2", 40.0)
+    after = cells(shop)
+    assert roll.cells is held
+    day = after[(after['Date'] == pd.Timestamp(TODAY)) & (after['Mode'] == "Cash + UPI03")]
+    assert len(day) == 1 and day['Paid'].iloc[0] == 90.0
+    assert_rebuilds_to(shop, after)
+
+
+def test_takings_put_settlements_on_the_day_and_mode_paid(shop):
+    sales = shop["load_data"]("Sales"); today = datetime.date.today()
+    assert shop["save_entries"]("Sales", sale("INV-T3", sales['NSP Code'].iloc[0], 2, 100.0, 50.0))
+    assert shop["update_balance"]("INV-T3", 40.0, "UPI03")
+    roll = shop["sync_rollup"]()
+    takings = shop["daily_takings"](roll, TODAY, today)
+    before = shop["daily_takings"](roll, TODAY, TODAY)
+    assert before.loc[pd.Timestamp(TODAY), "Cash"] == roll.between(TODAY, TODAY, ['Mode']).set_index('Mode').loc["Cash", "Paid"] - 40.0
+    assert takings.loc[pd.Timestamp(today), "UPI03"] >= 40.0
+    assert round(takings.to_numpy().sum(), 2) == round(roll.between(TODAY, today)['Paid'], 2)